@@ -1,11 +1,13 @@
 
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
 import requests
+import base64
 import json
 import os
 import time
-from src.visualization import analyze_data_for_chart, render_chart
+from src.visualization import analyze_data_for_chart, render_chart, should_attempt_chart, numeric_columns
 
 # Initialize LangSmith Tracing
 from src.config import (
@@ -24,6 +26,15 @@ if LANGCHAIN_TRACING_V2 and LANGCHAIN_API_KEY:
 # FastAPI backend URL
 API_BASE_URL = "http://localhost:8000"
 
+@st.cache_resource
+def get_api_session() -> requests.Session:
+    """Shared HTTP session so calls to the FastAPI backend reuse keep-alive connections."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=1)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 # Page Configuration
 st.set_page_config(
     page_title="AI SQL Agent", 
@@ -113,21 +124,18 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 # --- Sidebar: History & Settings ---
-with st.sidebar:
-    # Move New Chat to Sidebar (as requested)
-    if st.button("➕ New Chat", type="primary", use_container_width=True):
-        st.session_state.messages = []
-        st.rerun()
-    
-    st.divider()
-    st.title("📜 History")
-    
+@st.fragment
+def render_sidebar_history():
+    """
+    Clear button + query history list.
+    Runs as a fragment so clearing history or toggling an expander only reruns this block.
+    """
     if st.button("🔥 Clear DB History", use_container_width=True):
         try:
-            response = requests.delete(f"{API_BASE_URL}/history", timeout=5)
+            response = get_api_session().delete(f"{API_BASE_URL}/history", timeout=5)
             if response.status_code == 200:
                 st.success("History cleared!")
-                st.rerun()
+                st.rerun(scope="fragment")
             else:
                 st.error("Failed to clear history")
         except Exception as e:
@@ -135,28 +143,41 @@ with st.sidebar:
     
     st.divider()
 
-try:
-    response = requests.get(f"{API_BASE_URL}/history", timeout=5)
-    if response.status_code == 200:
-        history_data = response.json()
-        logs = history_data.get("logs", [])
-    else:
+    try:
+        response = get_api_session().get(f"{API_BASE_URL}/history", params={"limit": 10}, timeout=5)
+        if response.status_code == 200:
+            history_data = response.json()
+            logs = history_data.get("logs", [])
+        else:
+            logs = []
+            st.error("Failed to fetch history from API")
+    except Exception as e:
         logs = []
-        st.sidebar.error("Failed to fetch history from API")
-except Exception as e:
-    logs = []
-    st.sidebar.error(f"API Error: {e}")
-
-if logs:
-    # Show internal logic logs in reverse order - Titles only (no timestamps)
-    for log in reversed(logs[-10:]):
-        display_title = log['question'] if len(log['question']) < 30 else f"{log['question'][:27]}..."
-        with st.sidebar.expander(display_title):
-            st.write(f"**Q:** {log['question']}")
-            st.code(log['sql_query'], language="sql")
-            st.caption(f"Status: {'✅ Success' if log['success'] else '❌ Failed'}")
-else:
-    st.sidebar.info("No queries yet.")
+        st.error(f"API Error: {e}")
+
+    if logs:
+        # Show internal logic logs in reverse order - Titles only (no timestamps)
+        for log in reversed(logs):
+            display_title = log['question'] if len(log['question']) < 30 else f"{log['question'][:27]}..."
+            with st.expander(display_title):
+                st.write(f"**Q:** {log['question']}")
+                st.code(log['sql_query'], language="sql")
+                st.caption(f"Status: {'✅ Success' if log['success'] else '❌ Failed'}")
+    else:
+        st.info("No queries yet.")
+
+with st.sidebar:
+    # Move New Chat to Sidebar (as requested)
+    if st.button("➕ New Chat", type="primary", use_container_width=True):
+        st.session_state.messages = []
+        # Drop the stored turn too, so the next question is never mistaken for a replay of it
+        st.session_state.pop("current_turn", None)
+        st.rerun()
+    
+    st.divider()
+    st.title("📜 History")
+    
+    render_sidebar_history()
 
 # --- Main Interface ---
 
@@ -172,16 +193,200 @@ if not st.session_state.messages:
         </div>
     """, unsafe_allow_html=True)
 
+# --- Visualization ---
+@st.fragment
+def render_visualization(message_index: int):
+    """
+    Chart for one assistant message, built only when the user asks for it.
+    Runs as a fragment so generating a chart reruns this block alone; the chart is
+    stored on the message so it is never analyzed twice.
+    """
+    message = st.session_state.messages[message_index]
+    # Computed once and shared by the shape check, the chart analysis and the rendering
+    numeric_cols = numeric_columns(message["results"])
+    if not should_attempt_chart(message["results"], numeric_cols):
+        # Nothing plottable: don't offer a chart at all
+        return
+    with st.expander("📊 Visualization", expanded="chart" in message):
+        if "chart" not in message:
+            if not st.button("Generate chart", key=f"viz_{message_index}"):
+                return
+            df = message["results"]
+            chart = None
+            with st.spinner("Checking for visualizations..."):
+                viz_config = analyze_data_for_chart(message["question"], df, numeric_cols)
+                if viz_config:
+                    chart = render_chart(df, viz_config, numeric_cols)
+            # Keep the Figure itself: st.plotly_chart would rebuild and re-validate one from a dict on every rerun
+            message["chart"] = chart
+
+        if message["chart"] is not None:
+            st.plotly_chart(message["chart"], width="stretch")
+        else:
+            st.caption("No suitable chart for this result.")
+
 # Display chat messages from history on app rerun
-for message in st.session_state.messages:
+for message_index, message in enumerate(st.session_state.messages):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
         if "sql" in message:
             st.code(message["sql"], language="sql")
         if "results" in message:
             st.dataframe(message["results"], width="stretch")
-        if "chart" in message and message["chart"]:
-            st.plotly_chart(message["chart"], width="stretch")
+            render_visualization(message_index)
+
+# --- Chat Turn ---
+def stream_chat_response(prompt: str, chat_history: list, turn: dict):
+    """
+    Streams the generated SQL from the FastAPI /chat/stream endpoint (Server-Sent Events).
+    Yields tokens for st.write_stream; the final result event is stored in turn["api_response"].
+    Failures are normalized into the same response shape as /chat.
+    """
+    payload = {
+        "question": prompt,
+        "chat_history": chat_history
+    }
+    try:
+        with get_api_session().post(
+            f"{API_BASE_URL}/chat/stream",
+            params={"format": "arrow"},
+            json=payload,
+            stream=True,
+            timeout=30
+        ) as response:
+            if response.status_code != 200:
+                turn["api_response"] = {
+                    "success": False,
+                    "error": f"API error: {response.status_code}",
+                    "message": response.text
+                }
+                return
+
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    if event == "token":
+                        yield data["token"]
+                    elif event == "result":
+                        turn["api_response"] = data
+    except requests.exceptions.Timeout:
+        turn["api_response"] = {
+            "success": False,
+            "error": "Request timeout",
+            "message": "The API took too long to respond. Make sure the server is running on http://localhost:8000"
+        }
+    except Exception as e:
+        turn["api_response"] = {
+            "success": False,
+            "error": "Connection error",
+            "message": f"{str(e)}. Make sure the FastAPI server is running on http://localhost:8000"
+        }
+
+    if turn["api_response"] is None:
+        turn["api_response"] = {
+            "success": False,
+            "error": "Incomplete response",
+            "message": "The API stream ended before a result was returned."
+        }
+
+def response_to_dataframe(api_response: dict) -> pd.DataFrame:
+    """Builds the results DataFrame from the Arrow IPC payload, falling back to JSON records."""
+    if api_response.get("results_arrow"):
+        buffer = base64.b64decode(api_response["results_arrow"])
+        return pa.ipc.open_stream(buffer).read_pandas()
+    return pd.DataFrame(api_response.get("results") or [])
+
+def render_download_button(df: pd.DataFrame):
+    """Download CSV button for a result set."""
+    csv = df.to_csv(index=False).encode('utf-8')
+    st.download_button(
+        label="📥 Download Results as CSV",
+        data=csv,
+        file_name='query_results.csv',
+        mime='text/csv',
+    )
+
+@st.fragment
+def render_chat_turn(turn_id: int, prompt: str, chat_history: list):
+    """
+    Generate SQL -> run SQL -> visualize for a single question.
+    Runs as a fragment so widgets inside it (e.g. the CSV download) only rerun this block.
+    The computed turn is kept in session state, so those partial reruns never hit the API
+    or the visualization step again.
+    """
+    turn = st.session_state.get("current_turn")
+    is_new_turn = turn is None or turn["id"] != turn_id
+    assistant = st.chat_message("assistant")
+
+    if is_new_turn:
+        turn = {"id": turn_id, "api_response": None, "response": None}
+        st.session_state.current_turn = turn
+        # Generate SQL via API, rendering tokens as they arrive
+        with assistant:
+            st.markdown(f"**Generated SQL:**")
+            with st.spinner("Analyzing request..."):
+                st.write_stream(stream_chat_response(prompt, chat_history, turn))
+
+    api_response = turn["api_response"]
+
+    if not api_response.get("success"):
+        with assistant:
+            st.error(f"❌ Error: {api_response.get('error', 'Unknown error')}")
+            st.error(f"Details: {api_response.get('message', '')}")
+        return
+
+    sql_query = api_response.get("sql_query")
+    
+    # Display Assistant Response Logic with Streaming Effect
+    with assistant:
+        # Helper generator for streaming text
+        def stream_text(text: str):
+            for word in text.split(" "):
+                yield word + " "
+                time.sleep(0.05)
+
+        if not is_new_turn:
+            # Partial rerun: replay the stored response without recomputing anything
+            current_response = turn["response"]
+            st.markdown(f"**Generated SQL:**")
+            st.code(sql_query, language="sql")
+            st.write("Here are the results:")
+            if "results" in current_response:
+                df = current_response["results"]
+                st.dataframe(df, width="stretch")
+                render_visualization(turn["message_index"])
+                render_download_button(df)
+            else:
+                st.warning(current_response["content"])
+            return
+
+        # Stream the "Here are the results" message or any other info
+        st.write_stream(stream_text("Here are the results:"))
+        
+        current_response = {"role": "assistant", "content": "Here are the results:", "sql": sql_query, "question": prompt}
+        
+        # Add assistant response to chat history
+        turn["response"] = current_response
+        turn["message_index"] = len(st.session_state.messages)
+        st.session_state.messages.append(current_response)
+
+        df = response_to_dataframe(api_response)
+        if not df.empty:
+            st.dataframe(df, width="stretch")
+            current_response["results"] = df
+            
+            # Visualizations (computed lazily, on request)
+            render_visualization(turn["message_index"])
+            
+            # Add Download CSV button
+            render_download_button(df)
+
+        else:
+            st.warning("Query returned no results.")
+            current_response["content"] = "Query returned no results."
 
 # React to user input
 if prompt := st.chat_input("Ask a question data (e.g., 'Show top 5 customers')"):
@@ -199,103 +404,15 @@ if prompt := st.chat_input("Ask a question data (e.g., 'Show top 5 customers')")
             "role": msg["role"],
             "content": msg["content"]
         }
-        # Only include sql if it exists
+        # Only include sql if it exists. Result rows are never sent: SQL generation
+        # only uses role/content/sql, and rows would bloat every request.
         if "sql" in msg:
             chat_msg["sql"] = msg["sql"]
-        # Convert results to list of dicts if they're DataFrames
-        if "results" in msg:
-            if isinstance(msg["results"], pd.DataFrame):
-                chat_msg["results"] = msg["results"].to_dict(orient='records')
-            else:
-                chat_msg["results"] = msg["results"]
         chat_history.append(chat_msg)
 
-    # Generate SQL via API
-    with st.spinner("Analyzing request..."):
-        try:
-            payload = {
-                "question": prompt,
-                "chat_history": chat_history
-            }
-            response = requests.post(
-                f"{API_BASE_URL}/chat",
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                api_response = response.json()
-            else:
-                api_response = {
-                    "success": False,
-                    "error": f"API error: {response.status_code}",
-                    "message": response.text
-                }
-        except requests.exceptions.Timeout:
-            api_response = {
-                "success": False,
-                "error": "Request timeout",
-                "message": "The API took too long to respond. Make sure the server is running on http://localhost:8000"
-            }
-        except Exception as e:
-            api_response = {
-                "success": False,
-                "error": "Connection error",
-                "message": f"{str(e)}. Make sure the FastAPI server is running on http://localhost:8000"
-            }
-
-    if not api_response.get("success"):
-        st.error(f"❌ Error: {api_response.get('error', 'Unknown error')}")
-        st.error(f"Details: {api_response.get('message', '')}")
-    else:
-        sql_query = api_response.get("sql_query")
-        results = api_response.get("results")
-        
-        # Display Assistant Response Logic with Streaming Effect
-        with st.chat_message("assistant"):
-            # Helper generator for streaming text
-            def stream_text(text: str):
-                for word in text.split(" "):
-                    yield word + " "
-                    time.sleep(0.05)
-
-            st.markdown(f"**Generated SQL:**")
-            st.code(sql_query, language="sql")
-            
-            # Stream the "Here are the results" message or any other info
-            st.write_stream(stream_text("Here are the results:"))
-            
-            current_response = {"role": "assistant", "content": "Here are the results:", "sql": sql_query}
-
-            if results:
-                df = pd.DataFrame(results)
-                st.dataframe(df, width="stretch")
-                current_response["results"] = df
-                
-                # Visualizations
-                with st.spinner("Checking for visualizations..."):
-                    viz_config = analyze_data_for_chart(prompt, df)
-                    if viz_config:
-                        chart = render_chart(df, viz_config)
-                        if chart:
-                            st.plotly_chart(chart, width="stretch")
-                            current_response["chart"] = chart
-                
-                # Add Download CSV button
-                csv = df.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="📥 Download Results as CSV",
-                    data=csv,
-                    file_name='query_results.csv',
-                    mime='text/csv',
-                )
-
-            else:
-                st.warning("Query returned no results.")
-                current_response["content"] = "Query returned no results."
-
-            # Add assistant response to chat history
-            st.session_state.messages.append(current_response)
+    # Monotonic turn id: unlike the message count, it never repeats after "New Chat"
+    st.session_state.turn_counter = st.session_state.get("turn_counter", 0) + 1
+    render_chat_turn(st.session_state.turn_counter, prompt, chat_history)
 
 # Footer
 st.markdown("---")
@@ -1,8 +1,12 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Literal, Optional, Tuple
 import uvicorn
+import base64
+import orjson
+import pyarrow as pa
 import sys
 import os
 
@@ -26,14 +30,24 @@ if LANGCHAIN_TRACING_V2 and LANGCHAIN_API_KEY:
 else:
     print("ℹ️  LangSmith tracing disabled (set LANGCHAIN_TRACING_V2=true and LANGCHAIN_API_KEY in .env to enable)")
 
-from src.rag import generate_sql
-from src.database import run_sql_query
+from src.rag import generate_sql, generate_sql_stream, extract_sql, warm_up_retriever, clear_generation_caches
+from src.database import run_sql_query_cached, QueryResult
 from src.logger import log_query, get_logs, clear_logs
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up the embedder and vector store before serving, instead of on the first /chat."""
+    try:
+        warm_up_retriever()
+    except Exception as e:
+        print(f"⚠️  Retriever warm-up failed, it will load on first request: {e}")
+    yield
+
 app = FastAPI(
     title="AI SQL Agent API",
     description="FastAPI backend for AI SQL Agent",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # --- Pydantic Models ---
@@ -42,6 +56,7 @@ class ChatMessage(BaseModel):
     role: str
     content: str
     sql: Optional[str] = None
+    # Deprecated: ignored by SQL generation and no longer sent by the Streamlit client
     results: Optional[List[Dict[str, Any]]] = None
 
 class ChatRequest(BaseModel):
@@ -52,6 +67,8 @@ class ChatResponse(BaseModel):
     success: bool
     sql_query: Optional[str] = None
     results: Optional[List[Dict[str, Any]]] = None
+    # Base64 Arrow IPC stream, set instead of `results` when format=arrow
+    results_arrow: Optional[str] = None
     error: Optional[str] = None
     message: str
 
@@ -62,6 +79,111 @@ class QueryLog(BaseModel):
     success: bool
     error_message: Optional[str] = None
 
+# --- Helpers ---
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+ResultFormat = Literal["json", "arrow"]
+
+def execute_and_log(question: str, sql_query: str) -> Tuple[ChatResponse, Optional[QueryResult]]:
+    """
+    Executes the generated SQL, logs the outcome and builds the ChatResponse.
+    On success the rows are returned separately so the caller can serialize them
+    in the requested format (see attach_results).
+    """
+    if not sql_query:
+        return ChatResponse(
+            success=False,
+            error="Failed to generate SQL query",
+            message="The AI agent could not generate a valid SQL query"
+        ), None
+    
+    # Execute SQL
+    results, error = run_sql_query_cached(sql_query)
+    
+    # Log the query
+    if error:
+        log_query(question, sql_query, success=False, error_message=error)
+    else:
+        log_query(question, sql_query, success=True)
+    
+    # Prepare response
+    if error:
+        return ChatResponse(
+            success=False,
+            sql_query=sql_query,
+            error=error,
+            message=f"Error executing query: {error}"
+        ), None
+    else:
+        return ChatResponse(
+            success=True,
+            sql_query=sql_query,
+            message="Query executed successfully"
+        ), results
+
+def results_to_arrow(results: QueryResult, metadata: Optional[Dict[str, str]] = None) -> Optional[bytes]:
+    """
+    Serializes a QueryResult as an Arrow IPC stream (column-major, binary).
+    Returns None when a column mixes types Arrow can't unify, so the caller can fall back to JSON.
+    """
+    columns = list(zip(*results.rows)) if results.rows else [()] * len(results.columns)
+    try:
+        table = pa.Table.from_arrays([pa.array(col) for col in columns], names=results.columns)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return None
+    if metadata:
+        table = table.replace_schema_metadata(metadata)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def attach_results(response: ChatResponse, results: Optional[QueryResult], result_format: ResultFormat) -> ChatResponse:
+    """Adds the rows to the response, as Arrow IPC (base64) or JSON records. Dicts are only built here."""
+    if results is None:
+        return response
+    
+    if result_format == "arrow":
+        payload = results_to_arrow(results)
+        if payload is not None:
+            response.results_arrow = base64.b64encode(payload).decode("ascii")
+            return response
+    
+    response.results = results.to_records()
+    return response
+
+def sse_event(event: str, data: Any) -> bytes:
+    """Formats one Server-Sent Event with a JSON payload (serialized with orjson)."""
+    payload = orjson.dumps(data, default=str, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC)
+    return b"event: " + event.encode() + b"\ndata: " + payload + b"\n\n"
+
+def chat_event_stream(question: str, history_dicts: List[Dict[str, Any]], result_format: ResultFormat = "json") -> Iterator[bytes]:
+    """
+    Yields `token` events while the LLM writes the SQL, then a single `result` event with the ChatResponse.
+    A question already answered (same recent history) is replayed from the SQL memo as one `token` event.
+    Starlette iterates this sync generator in a worker thread, so the event loop is never blocked.
+    """
+    chunks = []
+    try:
+        for token in generate_sql_stream(question, history_dicts):
+            chunks.append(token)
+            yield sse_event("token", {"token": token})
+        
+        response, results = execute_and_log(question, extract_sql("".join(chunks)))
+        response = attach_results(response, results, result_format)
+    except Exception as e:
+        # Headers are already sent, so errors are reported in-band
+        log_query(question, "", success=False, error_message=str(e))
+        response = ChatResponse(
+            success=False,
+            error="Internal server error",
+            message=str(e)
+        )
+    
+    yield sse_event("result", response.dict())
+
 # --- Endpoints ---
 
 @app.get("/health")
@@ -74,15 +196,20 @@ async def health_check():
     }
 
 @app.post("/chat")
-async def chat(request: ChatRequest) -> ChatResponse:
+async def chat(
+    request: ChatRequest,
+    result_format: ResultFormat = Query("json", alias="format")
+) -> ChatResponse:
     """
     Process a user question and return generated SQL and results.
     
     Args:
         request: ChatRequest with question and optional chat_history
+        result_format: "json" (default) or "arrow"
         
     Returns:
-        ChatResponse with SQL query and execution results
+        ChatResponse with SQL query and execution results. With format=arrow, a successful
+        result is returned as an Arrow IPC stream whose schema metadata holds sql_query and message.
     """
     question = request.question
     chat_history = request.chat_history
@@ -91,59 +218,65 @@ async def chat(request: ChatRequest) -> ChatResponse:
         raise HTTPException(status_code=400, detail="Question cannot be empty")
     
     try:
-        # Convert Pydantic models back to dicts for rag.generate_sql
-        history_dicts = [msg.dict() for msg in chat_history]
+        # Convert Pydantic models back to dicts for rag.generate_sql (result rows are not needed)
+        history_dicts = [msg.dict(exclude={"results"}) for msg in chat_history]
         
-        # Generate SQL
+        # Generate SQL (memoized on question + recent history)
         sql_query = generate_sql(question, history_dicts)
         
-        if not sql_query:
-            return ChatResponse(
-                success=False,
-                error="Failed to generate SQL query",
-                message="The AI agent could not generate a valid SQL query"
-            )
+        response, results = execute_and_log(question, sql_query)
         
-        # Execute SQL
-        results, error = run_sql_query(sql_query)
+        if result_format == "arrow" and results is not None:
+            payload = results_to_arrow(results, {"sql_query": response.sql_query, "message": response.message})
+            if payload is not None:
+                return Response(content=payload, media_type=ARROW_STREAM_MEDIA_TYPE)
         
-        # Log the query
-        if error:
-            log_query(question, sql_query, success=False, error_message=error)
-        else:
-            log_query(question, sql_query, success=True)
-        
-        # Prepare response
-        if error:
-            return ChatResponse(
-                success=False,
-                sql_query=sql_query,
-                error=error,
-                message=f"Error executing query: {error}"
-            )
-        else:
-            return ChatResponse(
-                success=True,
-                sql_query=sql_query,
-                results=results,
-                message="Query executed successfully"
-            )
+        return attach_results(response, results, "json")
             
     except Exception as e:
         # Log unexpected errors
         log_query(question, "", success=False, error_message=str(e))
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    result_format: ResultFormat = Query("json", alias="format")
+) -> StreamingResponse:
+    """
+    Streaming variant of /chat using Server-Sent Events.
+    
+    Args:
+        request: ChatRequest with question and optional chat_history
+        result_format: "json" (default) or "arrow" (rows sent as base64 Arrow IPC in `results_arrow`)
+        
+    Returns:
+        text/event-stream of `token` events followed by one `result` event (a ChatResponse)
+    """
+    question = request.question
+    
+    if not question or not question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+    
+    history_dicts = [msg.dict(exclude={"results"}) for msg in request.chat_history]
+    return StreamingResponse(
+        chat_event_stream(question, history_dicts, result_format),
+        media_type="text/event-stream"
+    )
+
 @app.get("/history")
-async def get_history() -> Dict[str, Any]:
+async def get_history(limit: Optional[int] = None) -> Dict[str, Any]:
     """
     Retrieve query history logs.
     
+    Args:
+        limit: Optional number of most recent entries to return (default: all)
+        
     Returns:
         Dict containing list of query logs and count
     """
     try:
-        logs = get_logs()
+        logs = get_logs(limit)
         return {
             "success": True,
             "count": len(logs),
@@ -155,13 +288,14 @@ async def get_history() -> Dict[str, Any]:
 @app.delete("/history")
 async def clear_history() -> Dict[str, Any]:
     """
-    Clear all query history logs.
+    Clear all query history logs, along with the memoized reformulations and SQL.
     
     Returns:
         Dict containing success status
     """
     try:
         clear_logs()
+        clear_generation_caches()
         return {
             "success": True,
             "message": "Query history cleared successfully"
@@ -3,8 +3,11 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+# Load environment variables from .env once per process tree (child processes inherit them).
+# In production the environment is expected to be provided by the deployment instead.
+if os.environ.get("APP_ENV") != "production" and "_DOTENV_LOADED" not in os.environ:
+    load_dotenv()
+    os.environ["_DOTENV_LOADED"] = "1"
 
 # Base Directory
 BASE_DIR = Path(__file__).parent.parent
@@ -21,9 +24,10 @@ MYSQL_PORT = int(os.getenv("MYSQL_PORT", "3306"))
 MYSQL_USER = os.getenv("MYSQL_USER", "root")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "")
 MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "ai_sql_db")
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "8"))
 
 # Logging
-LOG_FILE = BASE_DIR / "query_logs.json"
+LOG_FILE = BASE_DIR / "query_logs.jsonl"  # JSON Lines, append-only
 
 # API Keys
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
@@ -38,7 +42,24 @@ LANGCHAIN_ENDPOINT = os.getenv("LANGCHAIN_ENDPOINT", "https://api.smith.langchai
 
 # Models
 EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# One batched, L2-normalized forward pass (cosine == inner product on unit vectors)
+EMBEDDING_ENCODE_KWARGS = {"batch_size": 64, "normalize_embeddings": True}
+# Inference backend for the embedding model: "torch" (default), "onnx" or "openvino".
+# onnx/openvino run the exported graph on CPU (pip install "sentence-transformers[onnx]").
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+# ONNX graph to load with the onnx backend; the default is the model repo's INT8 (AVX512-VNNI) export
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+EMBEDDING_MODEL_KWARGS = {"backend": EMBEDDING_BACKEND}
+if EMBEDDING_BACKEND == "onnx":
+    EMBEDDING_MODEL_KWARGS["model_kwargs"] = {
+        "file_name": EMBEDDING_ONNX_FILE,
+        "provider": "CPUExecutionProvider"
+    }
+# Parallel embedding workers used by build_index for large schemas
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", str(os.cpu_count() or 1)))
 LLM_MODEL_NAME = "llama-3.3-70b-versatile"
+# Follow-up questions: resolve context and write SQL in one LLM call (false = separate rewrite call first)
+FUSED_SQL_PROMPT = os.getenv("FUSED_SQL_PROMPT", "true").lower() == "true"
 
 # Vector Store
 PINECONE_INDEX_NAME = "ai-sql-agent"
@@ -46,3 +67,10 @@ PINECONE_DIMENSION = 384
 PINECONE_METRIC = "cosine"
 PINECONE_CLOUD = "aws"
 PINECONE_REGION = "us-east-1"
+RETRIEVER_TOP_K = 4
+# Schema indexes up to this many vectors are mirrored in memory and searched locally
+LOCAL_SCHEMA_INDEX_MAX_VECTORS = 1000
+# Records the SQLite file mtime the Pinecone index was last built from
+INDEX_SOURCE_MARKER = BASE_DIR / "data" / ".index_source_mtime"
+# {index name: host} of the Pinecone indexes, cached so new processes skip the describe_index lookup
+INDEX_HOST_CACHE = BASE_DIR / "data" / ".pinecone_index_hosts.json"
@@ -1,17 +1,118 @@
 
 import sqlite3
-import re
+import functools
+import itertools
+import threading
+import pandas as pd
+import streamlit as st
 from typing import List, Tuple, Optional, Dict, Any
-from src.config import DB_TYPE, DB_PATH, MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE
+from src.config import DB_TYPE, DB_PATH, MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE, MYSQL_POOL_SIZE
 
-# Try to import MySQL connector
-try:
-    import mysql.connector
-    from mysql.connector import Error as MySQLError
-    MYSQL_AVAILABLE = True
-except ImportError:
-    MYSQL_AVAILABLE = False
-    MySQLError = Exception
+class QueryResult:
+    """
+    Result of a query: column names plus the raw row tuples from the cursor.
+    Rows are only turned into dicts when a caller needs them (to_records), and
+    DataFrames are built straight from the tuples (to_dataframe).
+    """
+    __slots__ = ("columns", "rows")
+
+    def __init__(self, columns: List[str], rows: List[tuple]):
+        self.columns = columns
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """Rows as a list of {column: value} dicts, e.g. for JSON responses."""
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.rows]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame.from_records(self.rows, columns=self.columns)
+
+# Per-thread SQLite connections, keyed by database path
+_sqlite_local = threading.local()
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",     # 64 MB page cache
+    "PRAGMA mmap_size=268435456",   # 256 MB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+)
+
+# MySQL connection pool, created on first use so importing this module never
+# needs a reachable server
+_mysql_pool = None
+_mysql_pool_lock = threading.Lock()
+
+def get_sqlite_connection(db_path) -> sqlite3.Connection:
+    """
+    Returns this thread's SQLite connection for db_path, opening and tuning it on first use.
+    The connection is reused across queries instead of reconnecting every time.
+    """
+    connections = getattr(_sqlite_local, "connections", None)
+    if connections is None:
+        connections = _sqlite_local.connections = {}
+
+    key = str(db_path)
+    conn = connections.get(key)
+    if conn is None:
+        # Autocommit mode: read-only queries never leave a transaction open
+        conn = sqlite3.connect(key, check_same_thread=False, isolation_level=None)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        connections[key] = conn
+    return conn
+
+@functools.cache
+def get_mysql_connector():
+    """
+    Imports mysql.connector on first use, so SQLite deployments never load it.
+    Returns None if mysql-connector-python is not installed.
+    """
+    try:
+        import mysql.connector
+        import mysql.connector.pooling
+        return mysql.connector
+    except ImportError:
+        return None
+
+def _mysql_error() -> type:
+    """The connector's base Error class (plain Exception if the connector is missing)."""
+    connector = get_mysql_connector()
+    return connector.Error if connector is not None else Exception
+
+def get_mysql_pool():
+    """
+    Returns the shared MySQLConnectionPool, creating it on first use.
+    """
+    global _mysql_pool
+    if _mysql_pool is None:
+        with _mysql_pool_lock:
+            if _mysql_pool is None:
+                connector = get_mysql_connector()
+                _mysql_pool = connector.pooling.MySQLConnectionPool(
+                    pool_name="ai_sql",
+                    pool_size=MYSQL_POOL_SIZE,
+                    host=MYSQL_HOST,
+                    port=MYSQL_PORT,
+                    user=MYSQL_USER,
+                    password=MYSQL_PASSWORD,
+                    database=MYSQL_DATABASE,
+                    autocommit=True,  # read-only workload, no transaction bookkeeping
+                    use_pure=not connector.HAVE_CEXT  # prefer the C extension
+                )
+    return _mysql_pool
+
+def release_db_connection(conn) -> None:
+    """
+    Releases a connection from get_db_connection. Pooled MySQL connections go back
+    to the pool on close(); SQLite connections stay open for reuse.
+    """
+    if DB_TYPE == "mysql":
+        conn.close()
 
 def get_db_connection():
     """
@@ -19,73 +120,82 @@ def get_db_connection():
     Supports both SQLite and MySQL.
     """
     if DB_TYPE == "mysql":
-        if not MYSQL_AVAILABLE:
+        if get_mysql_connector() is None:
             raise ImportError("mysql-connector-python is required for MySQL support. Install with: pip install mysql-connector-python")
         
         try:
-            conn = mysql.connector.connect(
-                host=MYSQL_HOST,
-                port=MYSQL_PORT,
-                user=MYSQL_USER,
-                password=MYSQL_PASSWORD,
-                database=MYSQL_DATABASE
-            )
-            print(f"✅ Connected to MySQL: {MYSQL_USER}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}")
-            return conn
-        except MySQLError as e:
+            return get_mysql_pool().get_connection()
+        except _mysql_error() as e:
             raise ConnectionError(f"Failed to connect to MySQL: {str(e)}")
     else:
-        # SQLite (default)
-        conn = sqlite3.connect(str(DB_PATH))
-        print(f"✅ Connected to SQLite: {DB_PATH}")
-        return conn
+        # SQLite (default) - reused per thread
+        return get_sqlite_connection(DB_PATH)
+
+_ALLOWED_STARTS = ("SELECT", "WITH", "PRAGMA", "EXPLAIN")
+
+_FORBIDDEN_KEYWORDS = frozenset({
+    "UPDATE", "DELETE", "DROP", "ALTER", "INSERT",
+    "CREATE", "REPLACE", "TRUNCATE", "GRANT", "REVOKE"
+})
+_MAX_KEYWORD_LEN = max(len(keyword) for keyword in _FORBIDDEN_KEYWORDS)
+
+def has_forbidden_chain(query: str) -> bool:
+    """
+    Returns True if any semicolon in the query is followed (after optional whitespace)
+    by a whole-word forbidden keyword, e.g. "SELECT 1; DROP TABLE x".
+    Scans with str.find instead of running a regex over the full query.
+    """
+    n = len(query)
+    i = query.find(";")
+    while i != -1:
+        j = i + 1
+        while j < n and query[j].isspace():
+            j += 1
+
+        # Leading word after the semicolon; anything longer than a keyword can't match
+        word = query[j:j + _MAX_KEYWORD_LEN + 1]
+        end = 0
+        for ch in word:
+            if not (ch.isalnum() or ch == "_"):
+                break
+            end += 1
+        if word[:end].upper() in _FORBIDDEN_KEYWORDS:
+            return True
+
+        i = query.find(";", j)
+    return False
 
 def validate_sql_safety(query: str) -> Optional[str]:
     """
     Checks if the SQL query is safe (read-only).
     Returns None if safe, otherwise returns an error message.
     """
-    forbidden_keywords = [
-        "UPDATE", "DELETE", "DROP", "ALTER", "INSERT", 
-        "CREATE", "REPLACE", "TRUNCATE", "GRANT", "REVOKE"
-    ]
-    
-    # Clean the query for checking
-    # Remove leading/trailing whitespace
-    query_upper = query.strip().upper()
-    
-    # Check if valid starting keyword
-    allowed_starts = ("SELECT", "WITH", "PRAGMA", "EXPLAIN")
-    if not any(query_upper.startswith(keyword) for keyword in allowed_starts):
+    # Only the first few characters can match an allowed keyword
+    if not query.lstrip()[:7].upper().startswith(_ALLOWED_STARTS):
         return "Safety Violation: Only SELECT, WITH, PRAGMA, and EXPLAIN statements are allowed."
         
-    # Check for chained destructive commands
-    # Look for semicolon followed by forbidden keywords
-    # This regex looks for: semicolon, optional whitespace, forbidden keyword, word boundary
-    pattern = r";\s*(" + "|".join(forbidden_keywords) + r")\b"
-    if re.search(pattern, query_upper):
+    # Check for chained destructive commands (semicolon followed by a forbidden keyword)
+    if has_forbidden_chain(query):
         return "Safety Violation: Potentially destructive chained command detected."
         
     return None
 
-def execute_query_sqlite(cursor, query: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str]]:
+def execute_query_sqlite(cursor, query: str) -> Tuple[Optional[QueryResult], Optional[str]]:
     """Execute query on SQLite and return results."""
     try:
         cursor.execute(query)
         
         if cursor.description:
             columns = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchall()
-            results = [dict(zip(columns, row)) for row in rows]
-            return results, None
+            return QueryResult(columns, cursor.fetchall()), None
         else:
-            return [], None
+            return QueryResult([], []), None
     except sqlite3.Error as e:
         return None, str(e)
     except Exception as e:
         return None, f"Unexpected error: {str(e)}"
 
-def execute_query_mysql(cursor, query: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str]]:
+def execute_query_mysql(cursor, query: str) -> Tuple[Optional[QueryResult], Optional[str]]:
     """Execute query on MySQL and return results."""
     try:
         cursor.execute(query)
@@ -93,17 +203,15 @@ def execute_query_mysql(cursor, query: str) -> Tuple[Optional[List[Dict[str, Any
         # Get column names from cursor description
         if cursor.description:
             columns = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchall()
-            results = [dict(zip(columns, row)) for row in rows]
-            return results, None
+            return QueryResult(columns, cursor.fetchall()), None
         else:
-            return [], None
-    except MySQLError as e:
+            return QueryResult([], []), None
+    except _mysql_error() as e:
         return None, str(e)
     except Exception as e:
         return None, f"Unexpected error: {str(e)}"
 
-def run_sql_query(query: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str]]:
+def run_sql_query(query: str) -> Tuple[Optional[QueryResult], Optional[str]]:
     """
     Executes a SQL query against the configured database (SQLite or MySQL).
     
@@ -111,8 +219,8 @@ def run_sql_query(query: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[
         query (str): The SQL query to execute.
 
     Returns:
-        Tuple[Optional[List[Dict[str, Any]]], Optional[str]]: A tuple containing results (as list of dicts) 
-                                                              and error message (if any).
+        Tuple[Optional[QueryResult], Optional[str]]: A tuple containing results (columns + row tuples) 
+                                                     and error message (if any).
     """
     # Step 1: Validate Safety
     safety_error = validate_sql_safety(query)
@@ -121,15 +229,19 @@ def run_sql_query(query: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[
 
     try:
         conn = get_db_connection()
-        
-        if DB_TYPE == "mysql":
-            cursor = conn.cursor(dictionary=True)
-            results, error = execute_query_mysql(cursor, query)
-        else:  # SQLite
+        try:
             cursor = conn.cursor()
-            results, error = execute_query_sqlite(cursor, query)
-        
-        conn.close()
+            try:
+                if DB_TYPE == "mysql":
+                    results, error = execute_query_mysql(cursor, query)
+                else:  # SQLite
+                    cursor.arraysize = 1000
+                    results, error = execute_query_sqlite(cursor, query)
+            finally:
+                cursor.close()
+        finally:
+            # Always hand pooled connections back, even if the query failed
+            release_db_connection(conn)
         return results, error
         
     except ConnectionError as e:
@@ -137,43 +249,79 @@ def run_sql_query(query: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[
     except Exception as e:
         return None, f"Database error: {str(e)}"
 
+@st.cache_data(ttl=300, max_entries=128, show_spinner=False)
+def _run_read_query_cached(query: str) -> QueryResult:
+    """Cached execution of an already-validated read-only query. Errors raise so they are never cached."""
+    results, error = run_sql_query(query)
+    if error:
+        raise RuntimeError(error)
+    return results
+
+def run_sql_query_cached(query: str) -> Tuple[Optional[QueryResult], Optional[str]]:
+    """
+    Same contract as run_sql_query, but repeated read-only queries are served from an in-memory cache.
+    The cache key is the stripped query text; queries failing the safety check are never cached.
+    """
+    normalized = query.strip()
+
+    safety_error = validate_sql_safety(normalized)
+    if safety_error:
+        return None, safety_error
+
+    try:
+        return _run_read_query_cached(normalized), None
+    except RuntimeError as e:
+        return None, str(e)
+
+@functools.lru_cache(maxsize=1)
+def _load_db_schema() -> Dict[str, List[str]]:
+    """
+    Reads table names and columns from the configured database.
+    Raises on failure so that errors are never memoized.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        try:
+            # One round-trip for every (table, column, type) row, ordered by table
+            if DB_TYPE == "mysql":
+                cursor.execute(
+                    "SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE FROM INFORMATION_SCHEMA.COLUMNS "
+                    "WHERE TABLE_SCHEMA = %s ORDER BY TABLE_NAME, ORDINAL_POSITION",
+                    (MYSQL_DATABASE,)
+                )
+            else:  # SQLite
+                cursor.execute(
+                    "SELECT m.name, p.name, p.type FROM sqlite_master m "
+                    "JOIN pragma_table_info(m.name) p "
+                    "WHERE m.type = 'table' ORDER BY m.rowid, p.cid"
+                )
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    finally:
+        # Always hand pooled connections back, even if the query failed
+        release_db_connection(conn)
+    
+    return {
+        table: [f"{column} ({col_type})" for _, column, col_type in columns]
+        for table, columns in itertools.groupby(rows, key=lambda row: row[0])
+    }
+
 def get_db_schema() -> Dict[str, List[str]]:
     """
     Retrieves the schema (table names and columns) from the configured database.
-    Supports both SQLite and MySQL.
+    Supports both SQLite and MySQL. The result is memoized until invalidate_schema_cache().
     
     Returns:
         Dict with table names as keys and list of columns as values.
     """
-    schema = {}
-    
     try:
-        conn = get_db_connection()
-        
-        if DB_TYPE == "mysql":
-            cursor = conn.cursor()
-            # Get table names from MySQL
-            cursor.execute(f"SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = '{MYSQL_DATABASE}'")
-            tables = [row[0] for row in cursor.fetchall()]
-            
-            for table in tables:
-                cursor.execute(f"SELECT COLUMN_NAME, COLUMN_TYPE FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = '{MYSQL_DATABASE}' AND TABLE_NAME = '{table}'")
-                columns = cursor.fetchall()
-                schema[table] = [f"{col[0]} ({col[1]})" for col in columns]
-        else:  # SQLite
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = [row[0] for row in cursor.fetchall()]
-            
-            for table in tables:
-                cursor.execute(f"PRAGMA table_info({table});")
-                columns = cursor.fetchall()
-                # col[1] is name, col[2] is type
-                schema[table] = [f"{col[1]} ({col[2]})" for col in columns]
-        
-        conn.close()
-        
+        return _load_db_schema()
     except Exception as e:
         print(f"❌ Error fetching schema: {e}")
-    
-    return schema
+        return {}
+
+def invalidate_schema_cache() -> None:
+    """Forgets the memoized schema, e.g. before re-indexing a changed database."""
+    _load_db_schema.cache_clear()
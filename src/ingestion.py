@@ -1,8 +1,10 @@
 
 import time
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from langchain_core.documents import Document
-from langchain_pinecone import PineconeVectorStore
 from langchain_huggingface import HuggingFaceEmbeddings
 from pinecone import Pinecone, ServerlessSpec
 from src.config import (
@@ -13,12 +15,19 @@ from src.config import (
     PINECONE_CLOUD, 
     PINECONE_REGION,
     EMBEDDING_MODEL_NAME,
+    EMBEDDING_ENCODE_KWARGS,
+    EMBEDDING_MODEL_KWARGS,
+    EMBEDDING_WORKERS,
     LANGCHAIN_TRACING_V2,
     LANGCHAIN_API_KEY,
     LANGCHAIN_PROJECT,
-    LANGCHAIN_ENDPOINT
+    LANGCHAIN_ENDPOINT,
+    DB_TYPE,
+    DB_PATH,
+    INDEX_SOURCE_MARKER,
+    INDEX_HOST_CACHE
 )
-from src.database import get_db_schema
+from src.database import get_db_schema, invalidate_schema_cache
 
 # Initialize LangSmith Tracing
 if LANGCHAIN_TRACING_V2 and LANGCHAIN_API_KEY:
@@ -30,18 +39,92 @@ if LANGCHAIN_TRACING_V2 and LANGCHAIN_API_KEY:
 else:
     print("ℹ️  LangSmith tracing disabled")
 
+# Documents built from the last schema seen, keyed by its fingerprint
+_DOCS_CACHE: dict = {}
+
+def schema_fingerprint(schema: dict) -> int:
+    """Order-independent hash of a {table: [columns]} schema."""
+    return hash(tuple(sorted((table, tuple(columns)) for table, columns in schema.items())))
+
+# Vectors per Pinecone upsert request
+UPSERT_BATCH_SIZE = 100
+
 def create_documents_from_schema() -> list[Document]:
     """Convert DB schema to a list of LangChain Documents."""
     schema = get_db_schema()
+    fingerprint = schema_fingerprint(schema)
+    cached = _DOCS_CACHE.get(fingerprint)
+    if cached is not None:
+        return cached
+
     docs = []
     for table, columns in schema.items():
         # columns is a list of "ColName (Type)"
         col_info = "\n".join([f"- {col}" for col in columns])
         content = f"Table: {table}\nColumns:\n{col_info}"
         docs.append(Document(page_content=content, metadata={"table": table}))
+
+    if schema:
+        _DOCS_CACHE.clear()
+        _DOCS_CACHE[fingerprint] = docs
     return docs
 
-def build_index():
+def get_source_mtime() -> Optional[float]:
+    """Modification time of the SQLite database the index is built from (None for MySQL)."""
+    if DB_TYPE != "sqlite" or not DB_PATH.exists():
+        return None
+    return os.path.getmtime(DB_PATH)
+
+def is_index_current(source_mtime: Optional[float]) -> bool:
+    """True if the index was last built from a database with this exact mtime."""
+    if source_mtime is None or not INDEX_SOURCE_MARKER.exists():
+        return False
+    try:
+        return float(INDEX_SOURCE_MARKER.read_text()) == source_mtime
+    except ValueError:
+        return False
+
+def wait_until(condition, timeout: float = 120.0, initial_delay: float = 0.2, max_delay: float = 5.0) -> None:
+    """Polls condition() with exponential backoff until it is true; raises TimeoutError after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while not condition():
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Timed out after {timeout:.0f}s waiting for Pinecone")
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+def embed_texts(embeddings, texts: list[str], workers: int = EMBEDDING_WORKERS) -> list[list[float]]:
+    """
+    Embeds texts, splitting large inputs into contiguous chunks encoded on a thread pool
+    (the model releases the GIL during its forward pass). Output order matches texts.
+    """
+    batch_size = EMBEDDING_ENCODE_KWARGS.get("batch_size", 32)
+    workers = min(workers, len(texts) // batch_size)
+    if workers <= 1:
+        return embeddings.embed_documents(texts)
+
+    try:
+        import torch
+    except ImportError:
+        torch = None
+    if torch is not None:
+        # One intra-op thread per worker, so the workers don't oversubscribe the cores
+        # (process-wide setting, restored below)
+        previous_threads = torch.get_num_threads()
+        torch.set_num_threads(1)
+
+    chunk_size = -(-len(texts) // workers)  # ceil division
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(embeddings.embed_documents, chunks)
+            return [vector for chunk_vectors in results for vector in chunk_vectors]
+    finally:
+        if torch is not None:
+            torch.set_num_threads(previous_threads)
+
+def build_index(force: bool = False):
     if not PINECONE_API_KEY:
         raise ValueError("PINECONE_API_KEY not found in environment variables.")
 
@@ -50,41 +133,76 @@ def build_index():
 
     # Check/Create Index
     existing_indexes = [i.name for i in pc.list_indexes()]
+    if not force and PINECONE_INDEX_NAME in existing_indexes and is_index_current(get_source_mtime()):
+        print("Database unchanged since the last build, skipping re-index (pass --force to rebuild).")
+        return
+
     if PINECONE_INDEX_NAME in existing_indexes:
-        # We need to check if dimensions match, or just always recreate to be safe since we are switching back
-        # The user might have a 768 dim index now. We need 384.
-        # It is safer to delete and recreate.
-        print(f"Deleting existing index {PINECONE_INDEX_NAME} to ensure correct dimensions (384)...")
-        pc.delete_index(PINECONE_INDEX_NAME)
-        time.sleep(10) # Wait for deletion to propagate
-
-    print(f"Creating index: {PINECONE_INDEX_NAME}")
-    pc.create_index(
-        name=PINECONE_INDEX_NAME,
-        dimension=PINECONE_DIMENSION,
-        metric=PINECONE_METRIC,
-        spec=ServerlessSpec(cloud=PINECONE_CLOUD, region=PINECONE_REGION)
-    )
-    while not pc.describe_index(PINECONE_INDEX_NAME).status['ready']:
-        time.sleep(1)
+        desc = pc.describe_index(PINECONE_INDEX_NAME)
+        if desc.dimension == PINECONE_DIMENSION and desc.metric == PINECONE_METRIC:
+            # Compatible index: overwrite vectors in place instead of recreating it
+            print(f"Reusing existing index {PINECONE_INDEX_NAME} ({desc.dimension} dims, {desc.metric}).")
+        else:
+            print(f"Deleting existing index {PINECONE_INDEX_NAME} "
+                  f"({desc.dimension} dims, {desc.metric}; need {PINECONE_DIMENSION}, {PINECONE_METRIC})...")
+            pc.delete_index(PINECONE_INDEX_NAME)
+            wait_until(lambda: PINECONE_INDEX_NAME not in [i.name for i in pc.list_indexes()])
+            existing_indexes.remove(PINECONE_INDEX_NAME)
 
-    # Generate Docs
+    if PINECONE_INDEX_NAME not in existing_indexes:
+        print(f"Creating index: {PINECONE_INDEX_NAME}")
+        pc.create_index(
+            name=PINECONE_INDEX_NAME,
+            dimension=PINECONE_DIMENSION,
+            metric=PINECONE_METRIC,
+            spec=ServerlessSpec(cloud=PINECONE_CLOUD, region=PINECONE_REGION)
+        )
+        # A new index gets a new host
+        INDEX_HOST_CACHE.unlink(missing_ok=True)
+        wait_until(lambda: pc.describe_index(PINECONE_INDEX_NAME).status['ready'])
+
+    # Generate Docs from a fresh read of the schema
     print("Extracting schema...")
+    invalidate_schema_cache()
     docs = create_documents_from_schema()
     print(f"Found {len(docs)} tables.")
+    # Read only now: opening the database (WAL switch) can itself change the file's mtime
+    source_mtime = get_source_mtime()
 
-    # Embed and Upload
+    # Embed all tables (in parallel chunks for large schemas) and upload them in a single upsert
     print("Uploading to Pinecone (this may take a moment)...")
     
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    embeddings = HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs=EMBEDDING_MODEL_KWARGS,
+        encode_kwargs=EMBEDDING_ENCODE_KWARGS
+    )
+    texts = [doc.page_content for doc in docs]
+    vectors = embed_texts(embeddings, texts)
     
-    # We can use from_documents which handles batching usually
-    PineconeVectorStore.from_documents(
-        docs, 
-        embeddings, 
-        index_name=PINECONE_INDEX_NAME
+    # Stable ids make the upsert idempotent: re-indexing overwrites each table's vector.
+    # "text" is the metadata key PineconeVectorStore reads page_content from.
+    ids = [f"table:{doc.metadata['table']}" for doc in docs]
+    index = pc.Index(PINECONE_INDEX_NAME)
+    index.upsert(
+        vectors=[
+            (vector_id, vector, {"table": doc.metadata["table"], "text": text})
+            for vector_id, doc, text, vector in zip(ids, docs, texts, vectors)
+        ],
+        batch_size=UPSERT_BATCH_SIZE,
+        show_progress=False
     )
+
+    # Drop vectors for tables that no longer exist (or from older id schemes)
+    current_ids = set(ids)
+    stale_ids = [vector_id for page in index.list() for vector_id in page if vector_id not in current_ids]
+    if stale_ids:
+        print(f"Removing {len(stale_ids)} stale vectors...")
+        index.delete(ids=stale_ids)
+
+    if source_mtime is not None:
+        INDEX_SOURCE_MARKER.write_text(repr(source_mtime))
     print("Vector Store Successfully Updated!")
 
 if __name__ == "__main__":
-    build_index()
+    build_index(force="--force" in sys.argv)
@@ -1,12 +1,93 @@
-
 import json
+import orjson
 import os
+import atexit
+import threading
+import time
+from collections import deque
 from datetime import datetime
 from typing import List, Dict, Optional
 from src.config import LOG_FILE
 
+# Block size used when reading the log backwards from the end
+TAIL_READ_BYTES = 64 * 1024
+
+# Seconds between background flushes of buffered entries to LOG_FILE
+FLUSH_INTERVAL = 2.0
+
+# Once LOG_FILE grows past this many lines it is rotated to <LOG_FILE>.1 (one backup kept)
+MAX_LOG_LINES = 50_000
+
+# Entries kept in memory while LOG_FILE can't be written; beyond this the oldest are dropped
+MAX_BUFFERED_ENTRIES = 10_000
+
+# Entries logged but not yet written to disk. _LOCK also guards the file,
+# so readers never see an entry both in the buffer and on disk.
+_BUFFER = deque(maxlen=MAX_BUFFERED_ENTRIES)
+_LOCK = threading.Lock()
+_flusher = None
+# Lines currently in LOG_FILE; counted once on the first flush, then tracked incrementally
+_line_count = None
+
+def _maybe_rotate(written: int) -> None:
+    """Moves LOG_FILE to <LOG_FILE>.1 once it exceeds MAX_LOG_LINES. Caller holds _LOCK."""
+    global _line_count
+    if _line_count is None:
+        with open(LOG_FILE, "rb") as f:
+            _line_count = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(TAIL_READ_BYTES), b""))
+    else:
+        _line_count += written
+
+    if _line_count > MAX_LOG_LINES:
+        os.replace(LOG_FILE, f"{LOG_FILE}.1")
+        _line_count = 0
+
+def _dump_line(entry: Dict) -> bytes:
+    """Serializes one entry as a JSON line (stdlib json for the rare values orjson rejects, e.g. lone surrogates)."""
+    try:
+        return orjson.dumps(entry) + b"\n"
+    except orjson.JSONEncodeError:
+        return json.dumps(entry, separators=(",", ":")).encode("utf-8") + b"\n"
+
+def _flush_now() -> None:
+    """Writes all buffered entries to LOG_FILE in a single call, rotating it when it gets too long."""
+    with _LOCK:
+        if not _BUFFER:
+            return
+        lines = [_dump_line(entry) for entry in _BUFFER]
+        try:
+            with open(LOG_FILE, "ab") as f:
+                f.writelines(lines)
+        except Exception as e:
+            # Keep the entries buffered so the next flush retries them
+            print(f"Failed to write logs: {e}")
+            return
+        _BUFFER.clear()
+        try:
+            _maybe_rotate(len(lines))
+        except Exception as e:
+            print(f"Failed to rotate logs: {e}")
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        _flush_now()
+
+def _ensure_flusher() -> None:
+    """Starts the background flusher thread on first use."""
+    global _flusher
+    if _flusher is None:
+        with _LOCK:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, name="query-log-flusher", daemon=True)
+                _flusher.start()
+                atexit.register(_flush_now)
+
 def log_query(question: str, sql_query: str, success: bool, error_message: str = None) -> None:
-    """Logs the user query, generated SQL, and execution status."""
+    """
+    Logs the user query, generated SQL, and execution status (one JSON object per line).
+    The entry is buffered in memory and written to disk by a background thread.
+    """
     entry = {
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "question": question,
@@ -15,33 +96,96 @@ def log_query(question: str, sql_query: str, success: bool, error_message: str =
         "error_message": error_message
     }
 
-    logs = get_logs()
-    logs.append(entry)
+    with _LOCK:
+        if len(_BUFFER) == _BUFFER.maxlen:
+            print(f"Log buffer full ({_BUFFER.maxlen} entries), dropping the oldest entry")
+        _BUFFER.append(entry)
+    _ensure_flusher()
 
-    try:
-        with open(LOG_FILE, "w", encoding='utf-8') as f:
-            json.dump(logs, f, indent=4)
-    except Exception as e:
-        print(f"Failed to write logs: {e}")
+def _parse_lines(lines: List[bytes]) -> List[Dict]:
+    """Parses JSON Lines, skipping blank and partially written/corrupted lines."""
+    logs = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            logs.append(orjson.loads(line))
+        except ValueError:
+            # stdlib json also accepts the escaped lone surrogates _dump_line can write
+            try:
+                logs.append(json.loads(line))
+            except ValueError:
+                continue
+    return logs
+
+def _read_tail(f, limit: int) -> List[Dict]:
+    """Reads a binary JSON Lines file backwards from the end until `limit` entries are parsed."""
+    f.seek(0, os.SEEK_END)
+    pos = f.tell()
+    data = b""
+    while True:
+        lines = data.splitlines()
+        if pos > 0:
+            # The first line may have been cut in the middle
+            lines = lines[1:]
+        logs = _parse_lines(lines)
+        if len(logs) >= limit or pos == 0:
+            return logs[-limit:]
 
-def get_logs() -> List[Dict]:
-    """Retrieves the history of queries."""
-    if not os.path.exists(LOG_FILE):
+        step = min(TAIL_READ_BYTES, pos)
+        pos -= step
+        f.seek(pos)
+        data = f.read(step) + data
+
+def _read_path(path, limit: Optional[int]) -> List[Dict]:
+    """Reads the entries of one log file (the last `limit` of them, if given)."""
+    if not os.path.exists(path):
         return []
     
     try:
-        with open(LOG_FILE, "r", encoding='utf-8') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, ValueError):
-        return []
+        with open(path, "rb") as f:
+            if limit is None:
+                return _parse_lines(f.read().splitlines())
+            return _read_tail(f, limit)
     except Exception as e:
         print(f"Failed to read logs: {e}")
         return []
-        
+
+def _read_file(limit: Optional[int]) -> List[Dict]:
+    """
+    Reads entries already flushed to disk (the last `limit` of them, if given).
+    Older entries come from the rotated <LOG_FILE>.1 when LOG_FILE alone is too short,
+    e.g. right after a rotation.
+    """
+    logs = _read_path(LOG_FILE, limit)
+    if limit is None or len(logs) < limit:
+        logs = _read_path(f"{LOG_FILE}.1", None if limit is None else limit - len(logs)) + logs
+    return logs
+
+def get_logs(limit: Optional[int] = None) -> List[Dict]:
+    """
+    Retrieves the history of queries, oldest first.
+    With a limit, only the last `limit` entries are returned and only the tail of the file is read.
+    """
+    if limit is not None and limit <= 0:
+        return []
+
+    with _LOCK:
+        pending = list(_BUFFER)
+        if limit is not None and len(pending) >= limit:
+            return pending[-limit:]
+        return _read_file(None if limit is None else limit - len(pending)) + pending
+
 def clear_logs() -> None:
-    """Clears all query logs."""
-    try:
-        with open(LOG_FILE, "w", encoding='utf-8') as f:
-            json.dump([], f, indent=4)
-    except Exception as e:
-        print(f"Failed to clear logs: {e}")
+    """Clears all query logs, including entries not yet flushed and the rotated backup."""
+    global _line_count
+    with _LOCK:
+        _BUFFER.clear()
+        _line_count = 0
+        try:
+            with open(LOG_FILE, "w", encoding='utf-8'):
+                pass
+            if os.path.exists(f"{LOG_FILE}.1"):
+                os.remove(f"{LOG_FILE}.1")
+        except Exception as e:
+            print(f"Failed to clear logs: {e}")
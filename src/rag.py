@@ -1,139 +1,244 @@
 
 import re
-from typing import Optional
-from langchain_pinecone import PineconeVectorStore
-from langchain_huggingface import HuggingFaceEmbeddings
+import os
+import json
+import functools
+import operator
+import threading
+from collections import OrderedDict
+from typing import Iterator, List, Optional
+import numpy as np
+from langchain_core.documents import Document
 from langchain_core.prompts import PromptTemplate
 from langchain_groq import ChatGroq
 from src.config import (
     GROQ_API_KEY, 
+    PINECONE_API_KEY,
     PINECONE_INDEX_NAME, 
+    INDEX_HOST_CACHE,
     EMBEDDING_MODEL_NAME, 
-    LLM_MODEL_NAME
+    EMBEDDING_ENCODE_KWARGS,
+    EMBEDDING_MODEL_KWARGS,
+    LLM_MODEL_NAME,
+    RETRIEVER_TOP_K,
+    LOCAL_SCHEMA_INDEX_MAX_VECTORS,
+    FUSED_SQL_PROMPT
 )
 
 import streamlit as st
 import time
 
-@st.cache_resource
+# Number of most recent messages the prompts (and cache keys) take into account
+HISTORY_WINDOW = 6
+
+# Fenced ```sql ... ``` block in an LLM response
+SQL_BLOCK_RE = re.compile(r"```sql\s*(.*?)```", re.DOTALL)
+
+@st.cache_resource(show_spinner=False)
 def get_embeddings():
     print("🚀 Starting: Loading Embeddings...")
     start_time = time.time()
+    # Imported here: pulls in torch/transformers, which tests of the pure helpers don't need
+    from langchain_huggingface import HuggingFaceEmbeddings
     # No API key needed for local HF model
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    embeddings = HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs=EMBEDDING_MODEL_KWARGS,
+        encode_kwargs=EMBEDDING_ENCODE_KWARGS
+    )
     print(f"✅ Finished: Embeddings loaded in {time.time() - start_time:.2f}s")
     return embeddings
 
-@st.cache_resource
+def _read_index_hosts() -> dict:
+    """The {index name: host} map cached in INDEX_HOST_CACHE ({} if missing or unreadable)."""
+    try:
+        hosts = json.loads(INDEX_HOST_CACHE.read_text())
+        return hosts if isinstance(hosts, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def _write_index_hosts(hosts: dict) -> None:
+    try:
+        # Write-then-rename so concurrent processes never read a partial file
+        tmp_path = INDEX_HOST_CACHE.with_name(f"{INDEX_HOST_CACHE.name}.{os.getpid()}")
+        tmp_path.write_text(json.dumps(hosts))
+        os.replace(tmp_path, INDEX_HOST_CACHE)
+    except OSError as e:
+        print(f"⚠️ Could not cache the Pinecone index host: {e}")
+
+def get_index_host(pc) -> str:
+    """Host of the schema index, looked up once and then read from INDEX_HOST_CACHE by later processes."""
+    hosts = _read_index_hosts()
+    host = hosts.get(PINECONE_INDEX_NAME)
+    if host:
+        return host
+
+    host = pc.describe_index(PINECONE_INDEX_NAME).host
+    hosts[PINECONE_INDEX_NAME] = host
+    _write_index_hosts(hosts)
+    return host
+
+def forget_index_host() -> None:
+    """Drops the cached host of the schema index (and the connections built on it)."""
+    hosts = _read_index_hosts()
+    if hosts.pop(PINECONE_INDEX_NAME, None) is not None:
+        _write_index_hosts(hosts)
+    get_vectorstore.clear()
+    get_retriever.clear()
+
+def with_index_host_retry(call):
+    """
+    Runs call(), which must reach the index through get_vectorstore()/get_retriever().
+    If the cached host is gone (index deleted and recreated), looks the host up again and retries once.
+    """
+    from pinecone.exceptions import NotFoundException, PineconeProtocolError
+    from urllib3.exceptions import HTTPError
+    try:
+        return call()
+    except (NotFoundException, PineconeProtocolError, HTTPError) as e:
+        print(f"⚠️ Pinecone index unreachable at the cached host, looking it up again: {e}")
+        forget_index_host()
+        return call()
+
+@st.cache_resource(show_spinner=False)
 def get_vectorstore():
     print("🚀 Starting: Connecting to Pinecone...")
     start_time = time.time()
+    from pinecone import Pinecone
+    from langchain_pinecone import PineconeVectorStore
     embeddings = get_embeddings()
-    vectorstore = PineconeVectorStore.from_existing_index(
-        index_name=PINECONE_INDEX_NAME,
-        embedding=embeddings
-    )
+    pc = Pinecone(api_key=PINECONE_API_KEY)
+    # Connecting by host skips the describe_index round-trip (the host is cached on disk)
+    index = pc.Index(host=get_index_host(pc))
+    vectorstore = PineconeVectorStore(index=index, embedding=embeddings)
     print(f"✅ Finished: VectorStore connected in {time.time() - start_time:.2f}s")
     return vectorstore
 
-def get_llm():
-    if not GROQ_API_KEY:
-        raise ValueError("GROQ_API_KEY is not set")
-    return ChatGroq(
-        temperature=0,
-        model_name=LLM_MODEL_NAME,
-        api_key=GROQ_API_KEY
-    )
+@st.cache_resource(show_spinner=False)
+def get_retriever():
+    """Shared schema retriever, built once per process on top of the cached vectorstore."""
+    return get_vectorstore().as_retriever(search_kwargs={"k": RETRIEVER_TOP_K})
 
-def extract_sql(text: str) -> str:
-    """Extract SQL query from markdown-style code block."""
-    match = re.search(r"```sql\s*(.*?)```", text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    # Fallback: check if the text itself looks like SQL (starts with SELECT/WITH)
-    text = text.strip()
-    if text.upper().startswith("SELECT") or text.upper().startswith("WITH"):
-        return text
-    return text
+@st.cache_resource(show_spinner=False)
+def _load_local_schema_index():
+    """
+    Mirrors the (small) schema index in memory: the stored documents plus a matrix of
+    their unit-normalized vectors, pulled from Pinecone once without re-embedding.
+    Returns None if the index is too large to mirror. Raises if it is empty or can't be
+    read, so the failure is not cached and a later call tries again.
+    """
+    # Check the size first so a large index is never paged through
+    stats = with_index_host_retry(lambda: get_vectorstore().index.describe_index_stats())
+    total = stats.total_vector_count
+    if total > LOCAL_SCHEMA_INDEX_MAX_VECTORS:
+        return None
+    index = get_vectorstore().index
+    ids = [vector_id for page in index.list() for vector_id in page] if total else []
 
+    docs, rows = [], []
+    for start in range(0, len(ids), 100):
+        fetched = index.fetch(ids=ids[start:start + 100]).vectors
+        for vector in fetched.values():
+            metadata = dict(vector.metadata or {})
+            text = metadata.pop("text", None)
+            if text is None:
+                continue
+            docs.append(Document(page_content=text, metadata=metadata))
+            rows.append(vector.values)
+    if not docs:
+        raise ValueError("the schema index has no documents yet")
 
+    matrix = np.asarray(rows, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    print(f"✅ Schema index mirrored locally ({len(docs)} vectors)")
+    return docs, matrix
 
-def get_chat_history_str(chat_history: list) -> str:
+def get_local_schema_index():
     """
-    Helper to format chat history for the prompt.
-    EXPECTS: list of dicts or tuples. 
-    If dict: {'role': 'user', 'content': 'msg', 'sql': 'optional_sql'}
+    The in-memory schema mirror (see _load_local_schema_index), or None if the index is
+    too large or currently unavailable, so callers use Pinecone for this call.
     """
-    if not chat_history:
-        return "No history."
-    
-    formatted_history = []
-    for msg in chat_history[-6:]: 
-        # Handle both dicts and tuples for backward compatibility or ease of use
-        if isinstance(msg, dict):
-            role = msg.get("role", "unknown")
-            content = msg.get("content", "")
-            sql = msg.get("sql", None)
-        elif isinstance(msg, (tuple, list)) and len(msg) >= 2:
-            role = msg[0]
-            content = msg[1]
-            sql = None
-        else:
-            continue
-            
-        formatted_entry = f"{role.capitalize()}: {content}"
-        if sql:
-            formatted_entry += f"\n(Context SQL: {sql})"
-        
-        formatted_history.append(formatted_entry)
-        
-    return "\n".join(formatted_history)
+    try:
+        return _load_local_schema_index()
+    except Exception as e:
+        print(f"⚠️ Local schema index unavailable, querying Pinecone instead: {e}")
+        return None
 
-def detect_comparison_keywords(question: str) -> tuple:
+@functools.lru_cache(maxsize=256)
+def _embed_query(query: str) -> np.ndarray:
+    """Unit-normalized query embedding, memoized so repeated questions skip the model forward pass."""
+    vector = np.asarray(get_embeddings().embed_query(query), dtype=np.float32)
+    vector /= np.linalg.norm(vector)
+    vector.flags.writeable = False  # shared between cache hits
+    return vector
+
+def retrieve_schema_docs(query: str, k: int = RETRIEVER_TOP_K) -> List[Document]:
     """
-    Detect if user is asking for a comparison.
-    Returns: (is_comparison, comparison_type)
+    Top-k schema documents for the query. Uses cosine similarity against the in-memory
+    mirror when available (no network round-trip), otherwise the Pinecone retriever.
     """
-    question_lower = question.lower()
-    keywords = {
-        'vs': 'versus', 'versus': 'versus', 'compared to': 'comparison',
-        'compared with': 'comparison', 'difference': 'difference', 'growth': 'growth',
-        'change': 'change', 'increased': 'trend', 'decreased': 'trend',
-        'higher': 'comparison', 'lower': 'comparison', 'improvement': 'trend',
-        'decline': 'trend', 'quarter': 'time_period', 'month': 'time_period',
-        'year': 'time_period', 'last': 'time_reference', 'previous': 'time_reference'
-    }
-    
-    for keyword, comp_type in keywords.items():
-        if keyword in question_lower:
-            return True, comp_type
-    return False, None
+    local_index = get_local_schema_index()
+    if local_index is None:
+        return with_index_host_retry(lambda: get_retriever().invoke(query))
 
-def reformulate_question(question: str, chat_history: list) -> str:
+    docs, matrix = local_index
+    scores = matrix @ _embed_query(query)
+
+    k = min(k, len(docs))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [docs[i] for i in top]
+
+def retrieve_schema_docs_batch(queries: List[str], k: int = RETRIEVER_TOP_K) -> List[List[Document]]:
     """
-    Uses the LLM to rewrite a follow-up question into a standalone question.
-    Handles comparisons, temporal references, and context-dependent pronouns.
+    retrieve_schema_docs for many queries: all queries are embedded in one batched forward pass,
+    then ranked against the local mirror with one matrix product (or searched in Pinecone per vector).
     """
-    if not chat_history:
-        return question
-
-    history_str = get_chat_history_str(chat_history)
-    is_comparison, comp_type = detect_comparison_keywords(question)
-    
-    comparison_context = ""
-    if is_comparison:
-        comparison_context = f"""
+    if not queries:
+        return []
+    vectors = np.asarray(get_embeddings().embed_documents(queries), dtype=np.float32)
     
-    IMPORTANT: The user is asking for a COMPARISON (type: {comp_type}).
-    When you detect comparison keywords like 'vs', 'compared to', 'growth', 'change', etc:
-    - Identify what is being compared (time periods, groups, metrics, etc.)
-    - Include BOTH the current state AND the comparison baseline
-    - Examples:
-      * "vs last quarter" → include current quarter AND previous quarter
-      * "how much higher" → compare the two values
-      * "growth vs last year" → year-over-year comparison"""
+    local_index = get_local_schema_index()
+    if local_index is None:
+        return with_index_host_retry(lambda: [
+            get_vectorstore().similarity_search_by_vector(vector.tolist(), k=k) for vector in vectors
+        ])
+
+    docs, matrix = local_index
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = matrix @ vectors.T  # (num_docs, num_queries)
     
-    prompt = PromptTemplate.from_template("""
+    k = min(k, len(docs))
+    results = []
+    for column in scores.T:
+        top = np.argpartition(-column, k - 1)[:k]
+        top = top[np.argsort(-column[top])]
+        results.append([docs[i] for i in top])
+    return results
+
+def warm_up_retriever() -> None:
+    """
+    Loads the embedding model and schema index and runs one retrieval,
+    so the first user question doesn't pay for model load and connection setup.
+    """
+    print("🚀 Starting: Warming up retriever...")
+    start_time = time.time()
+    retrieve_schema_docs("tables and columns")
+    print(f"✅ Finished: Retriever warm in {time.time() - start_time:.2f}s")
+
+@st.cache_resource(show_spinner=False)
+def get_llm():
+    """Shared Groq chat client; its HTTP connection pool is reused across calls."""
+    if not GROQ_API_KEY:
+        raise ValueError("GROQ_API_KEY is not set")
+    return ChatGroq(
+        temperature=0,
+        model_name=LLM_MODEL_NAME,
+        api_key=GROQ_API_KEY,
+        streaming=True
+    )
+
+_REFORMULATE_PROMPT = PromptTemplate.from_template("""
     You are a helpful assistant rewriting questions to be standalone, understanding context and comparisons.
     
     Context History:
@@ -160,49 +265,8 @@ def reformulate_question(question: str, chat_history: list) -> str:
     
     Output ONLY the reformulated question, no explanations.
     """)
-    
-    llm = get_llm()
-    chain = prompt | llm
-    
-    response = chain.invoke({
-        "history": history_str,
-        "question": question,
-        "comparison_context": comparison_context
-    })
-    
-    refined_question = response.content.strip()
-    print(f"📝 Reformulated: '{question}' -> '{refined_question}'")
-    if is_comparison:
-        print(f"   🔄 Comparison detected: {comp_type}")
-    return refined_question
 
-def generate_sql(question: str, chat_history: list = None) -> str:
-    """
-    Generates a SQL query based on the user question and schema.
-    Handles follow-up questions by reformulating them first.
-    """
-    if chat_history is None:
-        chat_history = []
-        
-    # Step 1: Reformulate the question (handling "it", "them", etc.)
-    refined_question = reformulate_question(question, chat_history)
-    
-    vectorstore = get_vectorstore()
-    retriever = vectorstore.as_retriever()
-    
-    # Step 2: Retrieve relevant schema using the CLEAN question
-    docs = retriever.invoke(refined_question)
-    schema_text = "\n\n".join([doc.page_content for doc in docs])
-    
-    # Extract table names roughly for logging
-    table_names = [doc.page_content.split('(')[0].strip() for doc in docs]
-    print(f"Retrieved {len(docs)} schema documents: {table_names}")
-    
-    prompt = PromptTemplate.from_template("""
-    You are an expert SQL assistant skilled in business analysis and comparisons.
-    Use the schema below to answer the user's question by writing a correct SQL query.
-    
-    Rules:
+_SQL_RULES = """    Rules:
     - GENERATE ONLY READ-ONLY SQL (SELECT, WITH, PRAGMA). DO NOT generate UPDATE, DELETE, DROP, INSERT, or ALTER statements.
     - **dialect: SQLite**. Do NOT use `TOP n`. Use `LIMIT n` at the end of the query.
     - **Date Handling**: For extracting year/month, use SQLite's `strftime('%Y-%m', DateColumn)`. For year, use `strftime('%Y', DateColumn)`.
@@ -230,7 +294,13 @@ def generate_sql(question: str, chat_history: list = None) -> str:
     - Use JOINs correctly based on foreign keys defined in the schema.
     - Use sensible aliases for tables (e.g., first letter of table name) for clarity.
     - Return ONLY the SQL query, in a code block formatted like ```sql ... ``` — nothing else.
+"""
+
+_SQL_PROMPT = PromptTemplate.from_template("""
+    You are an expert SQL assistant skilled in business analysis and comparisons.
+    Use the schema below to answer the user's question by writing a correct SQL query.
     
+""" + _SQL_RULES + """    
     Schema:
     {schema}
     
@@ -239,21 +309,387 @@ def generate_sql(question: str, chat_history: list = None) -> str:
     
     Output the SQL inside a ```sql code block.
     """)
+
+# Single-call variant: the model resolves the follow-up itself instead of a separate rewrite
+_FUSED_SQL_PROMPT = PromptTemplate.from_template("""
+    You are an expert SQL assistant skilled in business analysis and comparisons.
+    The latest user question is a follow-up in a conversation and may depend on earlier turns.
+    First, silently restate it as a standalone question using the conversation history:
+    resolve pronouns ("their" = the entities from the previous query, "it" = the previous metric),
+    temporal references ("last quarter" relative to the current period), and for comparisons
+    include BOTH items being compared. Do not output the restated question.
+    Then write a correct SQL query for it using the schema below.
+    
+""" + _SQL_RULES + """
+    
+    Conversation History:
+    {history}
+    
+    Schema:
+    {schema}
     
-    llm = get_llm()
-    chain = prompt | llm
+    Latest User Question:
+    {question}
+    {comparison_context}
     
-    result = chain.invoke({
+    Output the SQL inside a ```sql code block.
+    """)
+
+@st.cache_resource(show_spinner=False)
+def get_reformulate_chain():
+    """Follow-up rewriting chain, composed once on top of the shared LLM."""
+    return _REFORMULATE_PROMPT | get_llm()
+
+@st.cache_resource(show_spinner=False)
+def get_sql_chain():
+    """SQL generation chain, composed once on top of the shared LLM."""
+    return _SQL_PROMPT | get_llm()
+
+@st.cache_resource(show_spinner=False)
+def get_fused_sql_chain():
+    """Follow-up SQL generation chain (rewrite + SQL in one call), composed once on top of the shared LLM."""
+    return _FUSED_SQL_PROMPT | get_llm()
+
+def extract_sql(text: str) -> str:
+    """Extract SQL query from markdown-style code block."""
+    match = SQL_BLOCK_RE.search(text)
+    if match:
+        return match.group(1).strip()
+    # Fallback: no fenced block, so the response is taken as bare SQL (e.g. starting with
+    # SELECT/WITH). Non-SQL text is returned too and rejected later by the safety check.
+    return text.strip()
+
+
+
+# Prompt prefixes for the common roles (anything else falls back to role.capitalize())
+_ROLE_PREFIXES = {"user": "User: ", "assistant": "Assistant: ", "system": "System: "}
+# Fast path for complete message dicts (the shape the app and API send)
+_MESSAGE_FIELDS = operator.itemgetter("role", "content", "sql")
+
+def get_chat_history_str(chat_history: list) -> str:
+    """
+    Helper to format chat history for the prompt.
+    EXPECTS: list of dicts or tuples. 
+    If dict: {'role': 'user', 'content': 'msg', 'sql': 'optional_sql'}
+    """
+    if not chat_history:
+        return "No history."
+    
+    return "\n".join(_format_history_lines(chat_history[-HISTORY_WINDOW:]))
+
+def _format_history_lines(messages: list) -> Iterator[str]:
+    """Yields the prompt lines for each message: "Role: content", then its SQL if any."""
+    for msg in messages:
+        # Handle both dicts and tuples for backward compatibility or ease of use
+        if isinstance(msg, dict):
+            try:
+                role, content, sql = _MESSAGE_FIELDS(msg)
+            except KeyError:
+                role, content, sql = msg.get("role", "unknown"), msg.get("content", ""), msg.get("sql")
+        elif isinstance(msg, (tuple, list)) and len(msg) >= 2:
+            role, content, sql = msg[0], msg[1], None
+        else:
+            continue
+
+        prefix = _ROLE_PREFIXES.get(role) or f"{role.capitalize()}: "
+        yield f"{prefix}{content}"
+        if sql:
+            yield f"(Context SQL: {sql})"
+
+def normalize_question(question: str) -> str:
+    """Collapses whitespace so trivially different spellings of a question share cache entries."""
+    return " ".join(question.split())
+
+def get_history_key(chat_history: list) -> tuple:
+    """
+    Convert the last HISTORY_WINDOW messages into a hashable key of (role, content, sql) triples.
+    Older messages and result rows are dropped, as the prompts never see them.
+    """
+    if not chat_history:
+        return ()
+
+    key = []
+    for msg in chat_history[-HISTORY_WINDOW:]:
+        if isinstance(msg, dict):
+            key.append((msg.get("role", "unknown"), msg.get("content", ""), msg.get("sql")))
+        elif isinstance(msg, (tuple, list)) and len(msg) >= 2:
+            key.append((msg[0], msg[1], None))
+    return tuple(key)
+
+def _history_from_key(history_key: tuple) -> list:
+    """Inverse of get_history_key: rebuilds the message dicts the prompts expect."""
+    return [
+        {"role": role, "content": content, "sql": sql}
+        for role, content, sql in history_key
+    ]
+
+# (keyword, comparison_type) pairs, checked in order; the first match wins
+_COMP_KEYWORDS = (
+    ('vs', 'versus'), ('versus', 'versus'), ('compared to', 'comparison'),
+    ('compared with', 'comparison'), ('difference', 'difference'), ('growth', 'growth'),
+    ('change', 'change'), ('increased', 'trend'), ('decreased', 'trend'),
+    ('higher', 'comparison'), ('lower', 'comparison'), ('improvement', 'trend'),
+    ('decline', 'trend'), ('quarter', 'time_period'), ('month', 'time_period'),
+    ('year', 'time_period'), ('last', 'time_reference'), ('previous', 'time_reference')
+)
+
+def detect_comparison_keywords(question: str) -> tuple:
+    """
+    Detect if user is asking for a comparison.
+    Returns: (is_comparison, comparison_type)
+    """
+    question_lower = question.lower()
+    for keyword, comp_type in _COMP_KEYWORDS:
+        if keyword in question_lower:
+            return True, comp_type
+    return False, None
+
+# Words that make a follow-up depend on earlier turns (pronouns, temporal and comparison references)
+_AMBIGUITY_WORDS = frozenset({
+    "it", "its", "they", "them", "their", "this", "that", "those", "these",
+    "he", "she", "his", "her", "above",
+    "same", "previous", "prior", "last", "earlier",
+    "vs", "versus", "compared", "difference", "growth", "change",
+    "higher", "lower", "increased", "decreased", "improvement", "decline"
+})
+
+# Shorter questions ("And Canada?", "By year?") are fragments that lean on the previous turn
+_MIN_STANDALONE_WORDS = 4
+
+def needs_reformulation(question: str) -> bool:
+    """True if the question refers back to the conversation and should be rewritten by the LLM."""
+    words = question.split()
+    if len(words) < _MIN_STANDALONE_WORDS:
+        return True
+    tokens = {word.strip(".,?!;:'\"()").lower() for word in words}
+    return not tokens.isdisjoint(_AMBIGUITY_WORDS)
+
+def get_comparison_context(question: str) -> tuple:
+    """
+    Extra prompt instructions for comparison questions.
+    Returns: (comparison_context, comparison_type), or ("", None) for other questions.
+    """
+    is_comparison, comp_type = detect_comparison_keywords(question)
+    if not is_comparison:
+        return "", None
+    
+    comparison_context = f"""
+    
+    IMPORTANT: The user is asking for a COMPARISON (type: {comp_type}).
+    When you detect comparison keywords like 'vs', 'compared to', 'growth', 'change', etc:
+    - Identify what is being compared (time periods, groups, metrics, etc.)
+    - Include BOTH the current state AND the comparison baseline
+    - Examples:
+      * "vs last quarter" → include current quarter AND previous quarter
+      * "how much higher" → compare the two values
+      * "growth vs last year" → year-over-year comparison"""
+    return comparison_context, comp_type
+
+def reformulate_question(question: str, chat_history: list) -> str:
+    """
+    Uses the LLM to rewrite a follow-up question into a standalone question.
+    Handles comparisons, temporal references, and context-dependent pronouns.
+    """
+    if not chat_history or not needs_reformulation(question):
+        return question
+    return _reformulate_cached(normalize_question(question), get_history_key(chat_history))
+
+@functools.lru_cache(maxsize=256)
+def _reformulate_cached(question: str, history_key: tuple) -> str:
+    """Memoized LLM rewrite, keyed by the question and the hashable history key."""
+    chat_history = _history_from_key(history_key)
+    history_str = get_chat_history_str(chat_history)
+    comparison_context, comp_type = get_comparison_context(question)
+    
+    response = get_reformulate_chain().invoke({
+        "history": history_str,
+        "question": question,
+        "comparison_context": comparison_context
+    })
+    
+    refined_question = response.content.strip()
+    print(f"📝 Reformulated: '{question}' -> '{refined_question}'")
+    if comp_type:
+        print(f"   🔄 Comparison detected: {comp_type}")
+    return refined_question
+
+@functools.lru_cache(maxsize=256)
+def _retrieve_schema_text(query: str) -> str:
+    """
+    Retrieves the schema documents relevant to the query, joined for the prompt.
+    Memoized per query string: the schema index doesn't change while the app runs.
+    """
+    docs = retrieve_schema_docs(query)
+    
+    # Extract table names roughly for logging
+    table_names = [doc.page_content.split('(')[0].strip() for doc in docs]
+    print(f"Retrieved {len(docs)} schema documents: {table_names}")
+    return "\n\n".join([doc.page_content for doc in docs])
+
+def _last_user_message(chat_history: list) -> str:
+    """Content of the most recent user message in the history ("" if there is none)."""
+    for msg in reversed(chat_history):
+        if isinstance(msg, dict):
+            role, content = msg.get("role"), msg.get("content")
+        elif isinstance(msg, (tuple, list)) and len(msg) >= 2:
+            role, content = msg[0], msg[1]
+        else:
+            continue
+        if role == "user" and content:
+            return content
+    return ""
+
+def _prepare_sql_chain(question: str, chat_history: list = None) -> tuple:
+    """
+    Reformulates the question, retrieves the relevant schema and builds the SQL prompt chain.
+    Returns (chain, inputs) so the caller can either invoke or stream it.
+    """
+    if chat_history is None:
+        chat_history = []
+    
+    if FUSED_SQL_PROMPT and chat_history and needs_reformulation(question):
+        # Follow-up: one LLM call that resolves the context and writes the SQL.
+        # Retrieval sees the previous user question too, so referenced tables are found.
+        retrieval_query = f"{_last_user_message(chat_history)}\n{question}".strip()
+        comparison_context, _ = get_comparison_context(question)
+        inputs = {
+            "history": get_chat_history_str(chat_history),
+            "schema": _retrieve_schema_text(retrieval_query),
+            "question": question,
+            "comparison_context": comparison_context
+        }
+        return get_fused_sql_chain(), inputs
+        
+    # Step 1: Reformulate the question (handling "it", "them", etc.)
+    refined_question = reformulate_question(question, chat_history)
+    
+    # Step 2: Retrieve relevant schema using the CLEAN question
+    schema_text = _retrieve_schema_text(refined_question)
+    
+    chain = get_sql_chain()
+    inputs = {
         "schema": schema_text,
         "question": refined_question # Pass the refined question to the generator
-    })
+    }
+    return chain, inputs
+
+# Generated SQL keyed by (normalized question, history key), shared by generate_sql and
+# generate_sql_stream. Entries expire after SQL_CACHE_TTL seconds; oldest evicted past SQL_CACHE_SIZE.
+SQL_CACHE_TTL = 24 * 60 * 60
+SQL_CACHE_SIZE = 256
+_SQL_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()
+_SQL_CACHE_LOCK = threading.Lock()
+
+def _lookup_sql(key: tuple) -> Optional[str]:
+    """The memoized query for key, or None if missing or expired."""
+    with _SQL_CACHE_LOCK:
+        entry = _SQL_CACHE.get(key)
+        if entry is None:
+            return None
+        stored_at, sql = entry
+        if time.monotonic() - stored_at > SQL_CACHE_TTL:
+            del _SQL_CACHE[key]
+            return None
+        _SQL_CACHE.move_to_end(key)
+        return sql
+
+def _store_sql(key: tuple, sql: str) -> None:
+    """Memoizes a generated query; empty results (failed generations) are not kept."""
+    if not sql:
+        return
+    with _SQL_CACHE_LOCK:
+        _SQL_CACHE[key] = (time.monotonic(), sql)
+        _SQL_CACHE.move_to_end(key)
+        while len(_SQL_CACHE) > SQL_CACHE_SIZE:
+            _SQL_CACHE.popitem(last=False)
+
+def generate_sql(question: str, chat_history: list = None) -> str:
+    """
+    Generates a SQL query based on the user question and schema.
+    Handles follow-up questions by reformulating them first.
+    Memoized on the whitespace-normalized question and the recent history (see generate_sql_cached).
+    """
+    return generate_sql_cached(normalize_question(question), get_history_key(chat_history))
 
-    sql_start_marker = "```sql"
-    sql_end_marker = "```"
-    raw_content = result.content
+def _stream_until_sql_closed(chain, inputs: dict) -> Iterator[str]:
+    """
+    Streams the chain's response and stops as soon as the ```sql block is closed,
+    so trailing commentary after the query is never waited for.
+    """
+    text = ""
+    fence_start = -1
+    for chunk in chain.stream(inputs):
+        if not chunk.content:
+            continue
+        yield chunk.content
+        text += chunk.content
+        if fence_start == -1:
+            fence_start = text.find("```sql")
+        if fence_start != -1 and text.find("```", fence_start + 6) != -1:
+            break
+
+def _generate_sql_uncached(question: str, chat_history: list = None) -> str:
+    """The full reformulate -> retrieve -> LLM pipeline behind generate_sql."""
+    chain, inputs = _prepare_sql_chain(question, chat_history)
+    raw_content = "".join(_stream_until_sql_closed(chain, inputs))
     print(f"LLM Raw Response:\n{raw_content}\n")
     
     final_sql = extract_sql(raw_content)
     print(f"Extracted SQL:\n{final_sql}\n")
 
     return final_sql
+
+def generate_sql_batch(questions: List[str]) -> List[str]:
+    """
+    Generates SQL for several standalone questions at once (no chat history).
+    Embeds all questions in one batch and sends the SQL prompts through the chain's
+    batch(), which runs the LLM calls concurrently.
+    """
+    if not questions:
+        return []
+    
+    doc_lists = retrieve_schema_docs_batch(questions)
+    inputs = [
+        {"schema": "\n\n".join(doc.page_content for doc in docs), "question": question}
+        for question, docs in zip(questions, doc_lists)
+    ]
+    responses = get_sql_chain().batch(inputs)
+    return [extract_sql(response.content) for response in responses]
+
+def generate_sql_stream(question: str, chat_history: list = None) -> Iterator[str]:
+    """
+    Same pipeline as generate_sql, but yields the raw LLM response token by token.
+    Callers should run extract_sql on the joined text once the stream is exhausted.
+    Shares generate_sql's memo: a cached query is yielded as a single ```sql block,
+    and a freshly streamed one is stored for later calls.
+    """
+    key = (normalize_question(question), get_history_key(chat_history))
+    cached = _lookup_sql(key)
+    if cached is not None:
+        yield f"```sql\n{cached}\n```"
+        return
+
+    chain, inputs = _prepare_sql_chain(question, chat_history)
+    chunks = []
+    for token in _stream_until_sql_closed(chain, inputs):
+        chunks.append(token)
+        yield token
+    _store_sql(key, extract_sql("".join(chunks)))
+
+def generate_sql_cached(question: str, history_key: tuple = ()) -> str:
+    """
+    Memoized SQL generation.
+    Takes the hashable history key from get_history_key so repeat questions skip the LLM round-trips.
+    """
+    key = (question, history_key)
+    sql = _lookup_sql(key)
+    if sql is None:
+        sql = _generate_sql_uncached(question, _history_from_key(history_key))
+        _store_sql(key, sql)
+    return sql
+
+def clear_generation_caches() -> None:
+    """Forgets memoized reformulations and generated SQL (e.g. when the history is cleared)."""
+    _reformulate_cached.cache_clear()
+    with _SQL_CACHE_LOCK:
+        _SQL_CACHE.clear()
@@ -1,15 +1,16 @@
 
-import json
 import re
+import orjson
 import pandas as pd
-import plotly.express as px
+import streamlit as st
 from typing import Optional, Dict, Any
 from langchain_groq import ChatGroq
 from langchain_core.prompts import PromptTemplate
 from src.config import GROQ_API_KEY, LLM_MODEL_NAME
 
+@st.cache_resource(show_spinner=False)
 def get_visualization_llm():
-    """Returns an instance of ChatGroq for visualization tasks."""
+    """Returns the shared ChatGroq instance for visualization tasks (built once per process)."""
     if not GROQ_API_KEY:
         raise ValueError("GROQ_API_KEY is not set")
         
@@ -19,20 +20,7 @@ def get_visualization_llm():
         api_key=GROQ_API_KEY
     )
 
-def analyze_data_for_chart(question: str, df: pd.DataFrame) -> Optional[Dict[str, Any]]:
-    """
-    Analyzes the dataframe and user question to determine the best chart type.
-    Returns specific configuration for Plotly.
-    """
-    # Relaxation: Allow single row if multiple numeric columns exist (Comparison)
-    if df.empty or (len(df) < 2 and len(df.select_dtypes(include=['number']).columns) < 2):
-        return None
-
-    columns = df.columns.tolist()
-    # Take a small sample to give context to the LLM
-    data_sample = df.head(3).to_dict(orient='records')
-    
-    prompt = PromptTemplate.from_template("""
+_VIZ_PROMPT = PromptTemplate.from_template("""
     You are a data visualization expert.
     
     User Question: {question}
@@ -60,9 +48,121 @@ def analyze_data_for_chart(question: str, df: pd.DataFrame) -> Optional[Dict[str
         "title": "A short descriptive title for the chart"
     }}
     """)
+
+@st.cache_resource(show_spinner=False)
+def get_visualization_chain():
+    """Chart analysis chain, composed once on top of the shared visualization LLM."""
+    return _VIZ_PROMPT | get_visualization_llm()
+
+# Fenced ```json {...} ``` block in an LLM response, and a bare {...} object as fallback
+JSON_BLOCK_RE = re.compile(r"```(?:json)?\s*({.*?})\s*```", re.DOTALL)
+JSON_OBJECT_RE = re.compile(r"({.*})", re.DOTALL)
+
+# Results larger than this are shown as a table only
+MAX_CHART_ROWS = 1000
+
+# Identifier columns (id, CustomerId, InvoiceID, customer_id): numeric, but never a measure or an axis
+ID_COLUMN_RE = re.compile(r"^(?:id|Id|ID)$|_(?:id|Id|ID)$|[a-z0-9](?:Id|ID)$")
+
+def is_id_column(name) -> bool:
+    """True for column names that look like keys (see ID_COLUMN_RE)."""
+    return bool(ID_COLUMN_RE.search(str(name)))
+
+def numeric_columns(df: pd.DataFrame) -> list:
+    """
+    Names of the numeric (non-bool) measure columns; identifier columns are left out.
+    Callers compute it once per result and pass it along.
+    """
+    return [col for col in df.select_dtypes(include=['number']).columns if not is_id_column(col)]
+
+def should_attempt_chart(df: pd.DataFrame, numeric_cols: Optional[list] = None) -> bool:
+    """
+    Cheap shape/dtype check run before the LLM chart analysis.
+    Requires at least one numeric column and either several rows or a single
+    row with multiple numeric columns (wide-format comparison).
+    """
+    if df.empty or len(df) > MAX_CHART_ROWS:
+        return False
+    if numeric_cols is None:
+        numeric_cols = numeric_columns(df)
+    numeric_count = len(numeric_cols)
+    if numeric_count == 0:
+        return False
+    return len(df) >= 2 or numeric_count >= 2
+
+# Category/value results up to this many rows are charted as bars without asking the LLM
+MAX_QUICK_BAR_ROWS = 30
+
+def _is_temporal(series: pd.Series) -> bool:
+    """True for datetime columns and for text columns holding ISO dates like '2010', '2010-01'."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+        return False
+    parsed = pd.to_datetime(series.head(MAX_QUICK_BAR_ROWS), format="ISO8601", errors="coerce")
+    return bool(parsed.notna().all())
+
+def quick_chart_config(df: pd.DataFrame, numeric_cols: Optional[list] = None) -> Optional[Dict[str, Any]]:
+    """
+    Rule-based chart choice for unambiguous two-column results (x, y):
+    date + number -> line, category + number (few rows) -> bar, number + number -> scatter
+    (line if x is a year). Returns None when the LLM should decide, e.g. when x is an id.
+    """
+    if len(df.columns) != 2:
+        return None
+    x, y = df.columns
+    if is_id_column(x):
+        return None
+    if numeric_cols is None:
+        numeric_cols = numeric_columns(df)
+    if y not in numeric_cols:
+        return None
+
+    if _is_temporal(df[x]):
+        chart_type = 'line'
+    elif x in numeric_cols:
+        chart_type = 'line' if 'year' in str(x).lower() else 'scatter'
+    elif len(df) <= MAX_QUICK_BAR_ROWS:
+        chart_type = 'bar'
+    else:
+        return None
+
+    return {
+        "chart_type": chart_type,
+        "x_axis": x,
+        "y_axis": y,
+        "title": f"{y} by {x}"
+    }
+
+def summarize_columns(df: pd.DataFrame) -> str:
+    """One-line description of a result: "<n> rows; col (dtype) e.g. value; ..."."""
+    first_row = df.head(1).to_dict(orient='records')[0] if len(df) else {}
+    parts = [f"{col} ({dtype}) e.g. {first_row.get(col)!r}" for col, dtype in df.dtypes.items()]
+    return f"{len(df)} rows; " + "; ".join(parts)
+
+def analyze_data_for_chart(question: str, df: pd.DataFrame, numeric_cols: Optional[list] = None) -> Optional[Dict[str, Any]]:
+    """
+    Analyzes the dataframe and user question to determine the best chart type.
+    Returns specific configuration for Plotly.
+    """
+    if numeric_cols is None:
+        numeric_cols = numeric_columns(df)
+
+    # Skip the LLM call when the shape can't produce a useful chart
+    if not should_attempt_chart(df, numeric_cols):
+        return None
+
+    # Standard two-column shapes don't need the LLM round-trip
+    config = quick_chart_config(df, numeric_cols)
+    if config is not None:
+        print(f"Visualization Config chosen by rules: {config}")
+        return config
+
+    columns = df.columns.tolist()
+    # Compact context for the LLM: row count plus each column's dtype and first value
+    data_sample = summarize_columns(df)
     
-    llm = get_visualization_llm()
-    chain = prompt | llm
+    chain = get_visualization_chain()
     
     try:
         response = chain.invoke({
@@ -74,17 +174,17 @@ def analyze_data_for_chart(question: str, df: pd.DataFrame) -> Optional[Dict[str
         content = response.content
         
         # Robust JSON extraction
-        match = re.search(r"```(?:json)?\s*({.*?})\s*```", content, re.DOTALL)
+        match = JSON_BLOCK_RE.search(content)
         if match:
             json_str = match.group(1)
         else:
-            match = re.search(r"({.*})", content, re.DOTALL)
+            match = JSON_OBJECT_RE.search(content)
             if match:
                 json_str = match.group(1)
             else:
                 return None
 
-        config = json.loads(json_str)
+        config = orjson.loads(json_str)
         print(f"Visualization Config generated: {config}")
         
         if config.get('chart_type') == 'none':
@@ -95,7 +195,20 @@ def analyze_data_for_chart(question: str, df: pd.DataFrame) -> Optional[Dict[str
         print(f"Error in visualization analysis: {e}")
         return None
 
-def render_chart(df: pd.DataFrame, config: dict):
+def downcast_numeric(df: pd.DataFrame, numeric_cols: Optional[list] = None) -> pd.DataFrame:
+    """Float columns to float32 and integer columns to the smallest integer type that fits."""
+    if numeric_cols is None:
+        numeric_cols = numeric_columns(df)
+    df = df.copy()
+    for col in numeric_cols:
+        kind = df[col].dtype.kind
+        if kind == 'f':
+            df[col] = pd.to_numeric(df[col], downcast='float')
+        elif kind in 'iu':
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+def render_chart(df: pd.DataFrame, config: dict, numeric_cols: Optional[list] = None):
     """
     Generates a Plotly figure based on the config.
     Handles special markers for wide-format single-row data.
@@ -104,22 +217,31 @@ def render_chart(df: pd.DataFrame, config: dict):
     x = config.get('x_axis')
     y = config.get('y_axis')
     title = config.get('title', 'Chart')
+    if numeric_cols is None:
+        numeric_cols = numeric_columns(df)
     
     # Handle wide-format (single row with multiple metrics)
     if x == "__columns__" and y == "__values__" and len(df) == 1:
         # Transform 1-row wide DF to 2-column long DF
-        metric_cols = df.select_dtypes(include=['number']).columns.tolist()
         df_long = pd.DataFrame({
-            'Metric': metric_cols,
-            'Value': [df.iloc[0][col] for col in metric_cols]
+            'Metric': numeric_cols,
+            'Value': df[numeric_cols].iloc[0].to_numpy()
         })
         x, y = 'Metric', 'Value'
         df = df_long
+        numeric_cols = ['Value']
 
     if x not in df.columns or (y and y not in df.columns):
          # invalid columns predicted
          return None
 
+    # Only the plotted columns are serialized to the browser; send them as 32-bit/smaller numbers
+    plotted = list(dict.fromkeys(col for col in (x, y) if col))
+    df = downcast_numeric(df[plotted], [col for col in numeric_cols if col in plotted])
+
+    # Deferred so importing this module (e.g. in tests) doesn't load plotly
+    import plotly.express as px
+
     try:
         if chart_type == "bar":
             fig = px.bar(df, x=x, y=y, title=title, template="plotly_dark")
@@ -6,8 +6,11 @@ import os
 # Add project root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.rag import generate_sql, reformulate_question
+import src.rag as rag
+from src.rag import generate_sql, reformulate_question, extract_sql, needs_reformulation
 from src.database import validate_sql_safety
+from src.visualization import should_attempt_chart, quick_chart_config
+import pandas as pd
 
 def test_conversational_memory():
     """
@@ -67,6 +70,10 @@ def test_unrelated_question_refusal():
     ("  SELECT * FROM users  ", True),
     ("  select * from users  ", True),
     ("  Delete from users", False),
+    ("SELECT 1;\n\tdrop table users", False),
+    ("SELECT 1;DELETE(users)", False),
+    ("SELECT 1; DROPPED_USERS", True),
+    ("SELECT 'a;b' AS c; SELECT 2", True),
 ])
 def test_sql_safety_injection(query, should_be_safe):
     """
@@ -79,9 +86,71 @@ def test_sql_safety_injection(query, should_be_safe):
     
     assert is_safe == should_be_safe, f"Expected safe={should_be_safe}, but got safe={is_safe}. Error: {error}"
 
+@pytest.mark.parametrize("llm_output, expected_sql", [
+    ("```sql\nSELECT * FROM Customer\n```", "SELECT * FROM Customer"),
+    ("Here you go:\n```sql\nSELECT 1;\n```\nDone.", "SELECT 1;"),
+    ("```sql SELECT 1``` and ```sql SELECT 2```", "SELECT 1"),
+    ("  SELECT Name FROM Artist  ", "SELECT Name FROM Artist"),
+    ("with cte AS (SELECT 1) SELECT * FROM cte", "with cte AS (SELECT 1) SELECT * FROM cte"),
+])
+def test_extract_sql(llm_output, expected_sql):
+    """
+    Test 4: Verify SQL is pulled out of fenced blocks and bare responses.
+    """
+    assert extract_sql(llm_output) == expected_sql
+
+@pytest.mark.parametrize("data, expected", [
+    ({}, False),                                          # empty result
+    ({"Country": ["Brazil", "Canada"]}, False),           # no numeric column
+    ({"Country": ["Brazil", "Canada"], "Total": [1, 2]}, True),
+    ({"Total": [10]}, False),                             # single value
+    ({"current_sales": [10], "previous_sales": [8]}, True),  # wide single-row comparison
+    ({"Total": list(range(1001))}, False),                # too many rows to chart
+    ({"Name": ["Ana", "Bo"], "CustomerId": [1, 2]}, False),  # ids are not measures
+    ({"invoice_id": [1, 2], "id": [3, 4]}, False),
+])
+def test_should_attempt_chart(data, expected):
+    """
+    Test 5: Verify trivially un-plottable results skip the visualization LLM call.
+    """
+    assert should_attempt_chart(pd.DataFrame(data)) == expected
+
+@pytest.mark.parametrize("data, expected_chart", [
+    ({"Month": ["2010-01", "2010-02"], "Sales": [10.5, 12.0]}, "line"),
+    ({"Country": ["Brazil", "Canada"], "Customers": [5, 8]}, "bar"),
+    ({"Year": [2010, 2011], "Total": [100, 120]}, "line"),
+    ({"Quantity": [1, 2], "Total": [0.99, 1.98]}, "scatter"),
+    ({"Country": ["Brazil", "Canada"], "Total": [1, 2], "Count": [3, 4]}, None),  # needs the LLM
+    ({"Track": [f"t{i}" for i in range(31)], "Plays": list(range(31))}, None),  # too many bars
+    ({"Name": ["Ana", "Bo"], "CustomerId": [1, 2]}, None),  # id as the value: table only
+    ({"InvoiceId": [1, 2], "Total": [0.99, 1.98]}, None),   # id as the x-axis: needs the LLM
+    ({"Country": ["Brazil", "Canada"], "Paid": [5, 8]}, "bar"),  # "...id" in a word is not an id
+])
+def test_quick_chart_config(data, expected_chart):
+    """
+    Test 6: Verify standard two-column results get a chart without the visualization LLM.
+    """
+    config = quick_chart_config(pd.DataFrame(data))
+    assert (config and config["chart_type"]) == expected_chart
+
+@pytest.mark.parametrize("question, expected", [
+    ("What are their emails?", True),
+    ("How does that compare to last year?", True),
+    ("North vs South?", True),
+    ("And Canada?", True),
+    ("Show her invoices from 2012.", True),
+    ("Show all customers from Brazil.", False),
+    ("How many tracks are in the database?", False),
+])
+def test_needs_reformulation(question, expected):
+    """
+    Test 7: Verify standalone questions skip the LLM reformulation round-trip.
+    """
+    assert needs_reformulation(question) == expected
+
 def test_ambiguous_question_handling():
     """
-    Test 4: Verify agent makes reasonable assumptions for ambiguous questions.
+    Test 8: Verify agent makes reasonable assumptions for ambiguous questions.
     """
     print("\n🔹 Test: Ambiguous Question")
     question = "Show me the top albums." 
@@ -94,6 +163,60 @@ def test_ambiguous_question_handling():
     assert "ORDER BY" in sql.upper(), "Result should be ordered to show 'top' items"
     assert "LIMIT" in sql.upper(), "Result should use LIMIT for 'top' items"
 
+def test_streamed_sql_is_memoized(monkeypatch):
+    """
+    Test 9: Verify a repeated streamed question is served from the SQL memo without an LLM call,
+    and that generate_sql reuses the streamed result.
+    """
+    class Chunk:
+        def __init__(self, content):
+            self.content = content
+
+    class FakeChain:
+        calls = 0
+        def stream(self, inputs):
+            FakeChain.calls += 1
+            yield Chunk("```sql\nSELECT COUNT(*) FROM Track\n```")
+
+    monkeypatch.setattr(rag, "_prepare_sql_chain", lambda question, chat_history=None: (FakeChain(), {}))
+    rag.clear_generation_caches()
+    question = "How many   tracks are there?"
+
+    first = extract_sql("".join(rag.generate_sql_stream(question)))
+    second = extract_sql("".join(rag.generate_sql_stream("How many tracks are there?")))
+    assert first == second == "SELECT COUNT(*) FROM Track"
+    assert generate_sql(question) == first
+    assert FakeChain.calls == 1, "Repeated questions should not reach the LLM"
+
+    rag.clear_generation_caches()
+    extract_sql("".join(rag.generate_sql_stream(question)))
+    assert FakeChain.calls == 2
+
+def test_chat_stream_replays_cached_sql(monkeypatch):
+    """
+    Test 10: Verify /chat/stream sends a memoized query as a single token event, without an LLM call.
+    """
+    import server
+    from src.database import QueryResult
+
+    def fail_prepare(question, chat_history=None):
+        raise AssertionError("The LLM chain should not be built for a memoized question")
+
+    rag.clear_generation_caches()
+    rag._store_sql((rag.normalize_question("Count tracks"), ()), "SELECT COUNT(*) FROM Track")
+    monkeypatch.setattr(rag, "_prepare_sql_chain", fail_prepare)
+    monkeypatch.setattr(server, "run_sql_query_cached", lambda sql: (QueryResult(["n"], [(3503,)]), None))
+    monkeypatch.setattr(server, "log_query", lambda *args, **kwargs: None)
+
+    events = list(server.chat_event_stream("Count tracks", []))
+    rag.clear_generation_caches()
+
+    assert len(events) == 2
+    assert events[0].startswith(b"event: token")
+    assert b"SELECT COUNT(*) FROM Track" in events[0]
+    assert events[1].startswith(b"event: result")
+    assert b'"success":true' in events[1]
+
 if __name__ == "__main__":
     # Manually run if executed as script
     try:
@@ -5,10 +5,10 @@ import os
 # Add project root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.rag import generate_sql
+from src.rag import generate_sql, generate_sql_batch
 from src.database import run_sql_query
 
-@pytest.mark.parametrize("test_case", [
+TEST_CASES = [
     {
         "name": "Simple Filtering (IN)",
         "question": "Show me all customers from Brazil or Canada.",
@@ -39,7 +39,9 @@ from src.database import run_sql_query
         "question": "What are the total sales for each Genre?",
         "expected_min_rows": 5
     }
-])
+]
+
+@pytest.mark.parametrize("test_case", TEST_CASES)
 def test_complex_natural_language_queries(test_case):
     """
     Integration test to verify the agent can handle various types of complex
@@ -66,3 +68,19 @@ def test_complex_natural_language_queries(test_case):
     assert row_count >= test_case['expected_min_rows'], \
         f"Expected at least {test_case['expected_min_rows']} rows, but got {row_count}"
 
+def test_generate_sql_batch():
+    """
+    Batch path: all questions are embedded together and the SQL prompts run concurrently.
+    """
+    questions = [test_case['question'] for test_case in TEST_CASES]
+    sqls = generate_sql_batch(questions)
+    assert len(sqls) == len(questions), "Expected one SQL query per question"
+    
+    for test_case, sql in zip(TEST_CASES, sqls):
+        print(f"\nBatch: {test_case['name']} -> {sql}")
+        assert "SELECT" in sql.upper(), "SQL must contain SELECT"
+        
+        results, error = run_sql_query(sql)
+        assert error is None, f"SQL Execution failed: {error}"
+        assert len(results) >= test_case['expected_min_rows'], \
+            f"Expected at least {test_case['expected_min_rows']} rows, but got {len(results)}"
@@ -0,0 +1,110 @@
+import pytest
+import sys
+import os
+from collections import deque
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import src.logger as logger
+
+@pytest.fixture
+def log_file(tmp_path, monkeypatch):
+    """Points the logger at a temporary LOG_FILE with an empty buffer and no background flusher."""
+    path = tmp_path / "query_logs.jsonl"
+    monkeypatch.setattr(logger, "LOG_FILE", path)
+    monkeypatch.setattr(logger, "_ensure_flusher", lambda: None)
+    monkeypatch.setattr(logger, "_line_count", None)
+    logger._BUFFER.clear()
+    yield path
+    logger._BUFFER.clear()
+
+def log_questions(questions):
+    for question in questions:
+        logger.log_query(question, "SELECT 1", success=True)
+
+def questions_of(logs):
+    return [entry["question"] for entry in logs]
+
+def test_get_logs_merges_file_and_buffer(log_file):
+    """
+    Test 1: Flushed and still-buffered entries are returned together, oldest first.
+    """
+    log_questions(["q0", "q1", "q2"])
+    logger._flush_now()
+    log_questions(["q3", "q4"])
+
+    assert questions_of(logger.get_logs()) == ["q0", "q1", "q2", "q3", "q4"]
+    assert questions_of(logger.get_logs(3)) == ["q2", "q3", "q4"]
+    assert questions_of(logger.get_logs(2)) == ["q3", "q4"]
+    assert logger.get_logs(0) == []
+
+def test_read_tail_across_blocks(log_file, monkeypatch):
+    """
+    Test 2: Reading the tail in blocks smaller than a line still returns exactly the last entries.
+    """
+    monkeypatch.setattr(logger, "TAIL_READ_BYTES", 64)
+    questions = [f"question {i}" for i in range(50)]
+    log_questions(questions)
+    logger._flush_now()
+
+    assert questions_of(logger.get_logs(7)) == questions[-7:]
+    assert questions_of(logger.get_logs(100)) == questions
+    assert questions_of(logger.get_logs()) == questions
+
+def test_rotation_keeps_history_readable(log_file, monkeypatch):
+    """
+    Test 3: After LOG_FILE is rotated to <LOG_FILE>.1, reads fall back to the backup.
+    """
+    monkeypatch.setattr(logger, "MAX_LOG_LINES", 5)
+    log_questions([f"q{i}" for i in range(6)])
+    logger._flush_now()
+
+    assert os.path.exists(f"{log_file}.1")
+    assert not log_file.exists()
+    assert questions_of(logger.get_logs(3)) == ["q3", "q4", "q5"]
+
+    log_questions(["q6", "q7"])
+    logger._flush_now()
+    assert questions_of(logger.get_logs(4)) == ["q4", "q5", "q6", "q7"]
+    assert len(logger.get_logs()) == 8
+
+    logger.clear_logs()
+    assert logger.get_logs() == []
+    assert not os.path.exists(f"{log_file}.1")
+
+def test_lone_surrogate_round_trip(log_file):
+    """
+    Test 4: Entries orjson can't encode are written with stdlib json and read back intact.
+    """
+    question = "broken \ud800 text"
+    log_questions([question, "plain"])
+    logger._flush_now()
+
+    assert questions_of(logger.get_logs()) == [question, "plain"]
+
+def test_failed_flush_keeps_entries(log_file, monkeypatch):
+    """
+    Test 5: A write error leaves the entries buffered for the next flush.
+    """
+    monkeypatch.setattr(logger, "LOG_FILE", log_file.parent / "missing" / log_file.name)
+    log_questions(["q0"])
+    logger._flush_now()
+    assert questions_of(logger.get_logs()) == ["q0"]
+
+    monkeypatch.setattr(logger, "LOG_FILE", log_file)
+    logger._flush_now()
+    assert not logger._BUFFER
+    assert questions_of(logger.get_logs()) == ["q0"]
+
+def test_buffer_is_bounded(log_file, monkeypatch):
+    """
+    Test 6: While writes keep failing, only the newest MAX_BUFFERED_ENTRIES entries are kept.
+    """
+    monkeypatch.setattr(logger, "_BUFFER", deque(maxlen=3))
+    monkeypatch.setattr(logger, "LOG_FILE", log_file.parent / "missing" / log_file.name)
+    for i in range(5):
+        log_questions([f"q{i}"])
+        logger._flush_now()
+
+    assert questions_of(logger.get_logs()) == ["q2", "q3", "q4"]